@@ -5,12 +5,14 @@ Telegram FAQ Bot — Main runtime with in-memory Q&A cache and matching.
 """
 from __future__ import annotations
 
+import asyncio
 import os
+import re
 import logging
 import time
 from typing import List, Tuple, Optional, Dict, Any
 
-from telegram import ReplyKeyboardMarkup, Update
+from telegram import Message, ReplyKeyboardMarkup, Update
 from telegram.ext import (
     ApplicationBuilder,
     ContextTypes,
@@ -25,7 +27,7 @@ from normalize import normalize_ar
 import db  # centralized DB service (connect, init_db)
 from commands import register_command_handlers, is_admin_private  # admin flows
 from cache import QACache
-from match import find_best_match  # returns dict with score, answer, id, ...
+from match import find_best_match_columns, model_id, set_encode_store  # returns dict with qa_id and score
 
 from dotenv import load_dotenv
 
@@ -53,45 +55,59 @@ APOLOGY_MSG = os.getenv("APOLOGY_MSG", "عذراً، لا أملك إجابة ع
 QA_CACHE_TTL = int(os.getenv("QA_CACHE_TTL", "30"))
 QA_CACHE_AUTO_REFRESH = os.getenv("QA_CACHE_AUTO_REFRESH", "false").lower() in ("1", "true", "yes")
 QA_CACHE_AUTO_INTERVAL = int(os.getenv("QA_CACHE_AUTO_INTERVAL", "120"))
+QA_EMB_DTYPE = os.getenv("QA_EMB_DTYPE", "float32").lower()
+QA_INDEX_TYPE = os.getenv("QA_INDEX_TYPE", "none").lower()
+# query embeddings persisted in the DB across restarts; 0 disables
+QA_EMB_CACHE_MAX = int(os.getenv("QA_EMB_CACHE_MAX", "10000"))
+
+# unanswered questions are queued and written in batches
+UNANSWERED_BATCH_SIZE = 100
+UNANSWERED_FLUSH_INTERVAL = 0.2
+# seconds between writes of buffered embedding-cache rows (see db.EmbeddingCache.flush)
+EMB_CACHE_FLUSH_INTERVAL = 5.0
+
+_MENTION_RE = re.compile(r"@\w+")
 
 
 def is_mentioned(update: Update, bot_username: Optional[str]) -> bool:
     """
     Return True if:
       - chat is private (explicit request for response),
+      - OR the message is a reply to the bot,
       - OR the bot is mentioned via @username in the text,
-      - OR message.entities contains a mention/text_mention,
-      - OR the message is a reply to the bot.
+      - OR message.entities contains a mention/text_mention.
+    Cheapest checks run first; entities are only walked when they can still match.
     """
-    if update.effective_message is None:
+    msg = update.effective_message
+    if msg is None:
         return False
 
-    chat = update.effective_chat
-    if chat and chat.type == "private":
+    if is_private_or_reply(update, bot_username):
         return True
 
-    text = update.effective_message.text or ""
+    if not bot_username:
+        return False
+    bu = bot_username.lower()
+    text = msg.text or ""
 
     # direct textual mention
-    if bot_username and text and f"@{bot_username}" in text:
+    if f"@{bot_username}" in text:
         return True
 
-    # check entities
-    entities = update.effective_message.entities or []
+    entities = msg.entities
+    if not entities:
+        return False
+
+    # without an "@" in the text only a text_mention can still point at the bot
+    has_at = "@" in text
     for ent in entities:
-        if ent.type == "mention":
-            mention_text = text[ent.offset:ent.offset + ent.length]
-            if mention_text.lower() == f"@{bot_username.lower()}":
+        if ent.type == "mention" and has_at:
+            if text[ent.offset:ent.offset + ent.length].lower() == f"@{bu}":
                 return True
         elif ent.type == "text_mention" and ent.user and ent.user.username:
-            if ent.user.username.lower() == bot_username.lower():
+            if ent.user.username.lower() == bu:
                 return True
 
-    reply = update.effective_message.reply_to_message
-    if reply and reply.from_user and reply.from_user.username:
-        if reply.from_user.username.lower() == bot_username.lower():
-            return True
-
     return False
 
 
@@ -99,14 +115,128 @@ def remove_mentions(text: str) -> str:
     """
     Remove @username mentions from the text.
     """
-    if not text:
-        return text
+    return _MENTION_RE.sub("", text).strip() if text else text
+
+def is_private_or_reply(update: Update, bot_username: Optional[str]) -> bool:
+    """Return True if the chat is private or the message replies to the bot."""
+    chat = update.effective_chat
+    if chat and chat.type == "private":
+        return True
+
+    reply = update.effective_message.reply_to_message if update.effective_message else None
+    if bot_username and reply and reply.from_user and reply.from_user.username:
+        return reply.from_user.username.lower() == bot_username.lower()
+    return False
 
-    import re
-    # remove @username mentions
-    text = re.sub(r"@\w+", "", text).strip()
-    
-    return text
+
+def strip_and_detect(msg: Message, bot_username: Optional[str]) -> Tuple[str, bool]:
+    """
+    Strip @mentions from the message text and detect a mention of the bot
+    in a single walk over `msg.entities`, which carry exact mention offsets.
+    Falls back to regex stripping when entities are absent or unusable.
+    Private chats and replies are not considered here — see `is_private_or_reply`.
+    """
+    text = msg.text or ""
+    bot_at = f"@{bot_username.lower()}" if bot_username else None
+    entities = msg.entities or ()
+
+    # entity offsets count UTF-16 units; they match str indices only when text has no astral chars
+    if not entities or len(text.encode("utf-16-le")) != 2 * len(text):
+        mentioned = bool(bot_at) and bot_at in text.lower()
+        return remove_mentions(text), mentioned
+
+    mentioned = False
+    parts = []
+    end = len(text)
+    for ent in sorted(entities, key=lambda e: e.offset, reverse=True):
+        if ent.type == "mention":
+            if bot_at and text[ent.offset:ent.offset + ent.length].lower() == bot_at:
+                mentioned = True
+            parts.append(text[ent.offset + ent.length:end])
+            end = ent.offset
+        elif ent.type == "text_mention" and bot_username and ent.user and ent.user.username:
+            if ent.user.username.lower() == bot_username.lower():
+                mentioned = True
+    parts.append(text[:end])
+
+    return "".join(reversed(parts)).strip(), mentioned
+
+def _get_pool(context: ContextTypes.DEFAULT_TYPE) -> db.ConnectionPool:
+    """Return the shared DB connection pool stored in app.bot_data."""
+    pool = context.application.bot_data.get("db_pool")
+    if pool is None:
+        pool = context.application.bot_data["db_pool"] = db.get_pool(DB_PATH)
+    return pool
+
+def _write_unanswered(pool: db.ConnectionPool, rows: List[Tuple[Optional[int], str, str]]) -> None:
+    try:
+        with pool.acquire() as conn:
+            db.log_unanswered_many(conn, rows)
+    except Exception:
+        logger.exception("Failed to log %d unanswered question(s).", len(rows))
+
+async def unanswered_writer(app) -> None:
+    """Background task: drain the unanswered queue and insert rows in batches."""
+    queue: asyncio.Queue = app.bot_data["unanswered_q"]
+    pool = app.bot_data["db_pool"]
+    loop = asyncio.get_running_loop()
+    rows: List[Tuple[Optional[int], str, str]] = []
+    try:
+        while True:
+            rows = [await queue.get()]
+            deadline = loop.time() + UNANSWERED_FLUSH_INTERVAL
+            while len(rows) < UNANSWERED_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    rows.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # hand the batch off first: a cancel during the write must not flush it a second time
+            batch, rows = rows, []
+            await asyncio.to_thread(_write_unanswered, pool, batch)
+    except asyncio.CancelledError:
+        # flush whatever is pending before shutting down
+        while not queue.empty():
+            rows.append(queue.get_nowait())
+        if rows:
+            _write_unanswered(pool, rows)
+        raise
+
+async def emb_cache_writer(store: db.EmbeddingCache) -> None:
+    """Background task: periodically persist the embedding cache's buffered writes off the event loop."""
+    try:
+        while True:
+            await asyncio.sleep(EMB_CACHE_FLUSH_INTERVAL)
+            try:
+                await asyncio.to_thread(store.flush)
+            except Exception:
+                logger.exception("Failed to flush the embedding cache.")
+    except asyncio.CancelledError:
+        store.flush()
+        raise
+
+async def _post_init(app) -> None:
+    app.bot_data["unanswered_q"] = asyncio.Queue()
+    app.bot_data["unanswered_task"] = asyncio.create_task(unanswered_writer(app))
+    store = app.bot_data.get("emb_store")
+    if store is not None:
+        app.bot_data["emb_store_task"] = asyncio.create_task(emb_cache_writer(store))
+
+async def _post_stop(app) -> None:
+    for key in ("unanswered_task", "emb_store_task"):
+        task = app.bot_data.pop(key, None)
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    # one pool serves the bot, QACache and the admin commands
+    pool = app.bot_data.get("db_pool")
+    if pool is not None:
+        pool.close_all()
 
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Main message handler: match user query to best answer and respond according to thresholds."""
@@ -120,35 +250,16 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     # get cache from application bot_data
     cache: Optional[QACache] = context.application.bot_data.get("qa_cache")
-    if not cache:
-        # fallback: read directly from DB if cache missing (shouldn't happen normally)
-        logger.warning("QACache missing from app.bot_data — reading directly from DB.")
-        conn = db.connect(DB_PATH)
-        try:
-            q_rows = db.list_all_qna(conn)
-            em_rows = db.load_all_embeddings(conn)
-            qas = []
-            embeddings = []
-            for r in q_rows:
-                qas.append({
-                    "id": int(r["id"]),
-                    "question": r["question"],
-                    "question_norm": r["question_norm"],
-                    "embedding": r["embedding"],
-                    "answer": r["answer"],
-                    "category": r["category"] or "",
-                })
-            for r in em_rows:
-                embeddings.append({
-                    "qa_id": int(r["qa_id"]),
-                    "embedding": r["embedding"],
-                })
-
-        finally:
-            conn.close()
-    else:
-        qas = cache.get_qas()
-        embeddings = cache.get_embeddings()
+    if cache is None:
+        # shouldn't happen normally: main() installs it; build it lazily so later messages reuse it
+        logger.warning("QACache missing from app.bot_data — creating it now.")
+        cache = context.application.bot_data.setdefault(
+            "qa_cache", QACache(DB_PATH, ttl=QA_CACHE_TTL, emb_dtype=QA_EMB_DTYPE, index_type=QA_INDEX_TYPE)
+        )
+
+    # one snapshot keeps the id, norm and embedding columns aligned even if a reload lands mid-message
+    snap = cache.snapshot()
+    qas, embeddings = snap.qas, snap.embeddings
 
     if not qas or not embeddings:
         logger.warning("No QAs loaded in cache or DB.")
@@ -160,34 +271,37 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     bot_username = context.bot.username if context and context.bot else None
 
-    mentioned = is_mentioned(update, bot_username)
-
-    text = remove_mentions(text)
-    best = find_best_match(text, qas)
+    text, mentioned = strip_and_detect(msg, bot_username)
+    mentioned = mentioned or is_private_or_reply(update, bot_username)
+    norm_text = normalize_ar(text)
+    best = find_best_match_columns(norm_text, snap.ids, snap.norms, snap.emb_matrix, snap.emb_scales, index=snap.index, exact_ids=snap.exact_ids, valid=snap.valid)
 
     if not best:
         logger.debug("Matcher returned no best result.")
         if mentioned:
-            try:
-                conn = db.connect(DB_PATH)
-                db.log_unanswered(conn, user_id=msg.from_user.id if msg.from_user else None,
-                                 question=text, question_norm=normalize_ar(text))
-            finally:
-                conn.close()
+            user_id = msg.from_user.id if msg.from_user else None
+            queue = context.application.bot_data.get("unanswered_q")
+            if queue is not None:
+                queue.put_nowait((user_id, text, norm_text))
+            else:
+                with _get_pool(context).acquire() as conn:
+                    db.log_unanswered(conn, user_id=user_id, question=text, question_norm=norm_text)
             await msg.reply_text(APOLOGY_MSG)
         return
 
     score = best.get("score")
     qa_id = best.get("qa_id")
 
-    qa = next((q for q in qas if q["id"] == qa_id), None)
+    qa = snap.by_id.get(qa_id)
     if not qa:
-        row = db.get_qna_by_id()
+        with _get_pool(context).acquire() as conn:
+            row = db.get_qna_by_id(conn, qa_id)
         if not row:
             logger.error("No Q&A found for ID %s in cache or DB.", qa_id)
             if mentioned:
                 await msg.reply_text(APOLOGY_MSG)
             return
+        qa = dict(row)
 
     answer = qa.get("answer")
     norm_question = qa.get("question_norm", "")
@@ -271,9 +385,19 @@ def main():
     finally:
         conn.close()
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = ApplicationBuilder().token(BOT_TOKEN).post_init(_post_init).post_stop(_post_stop).build()
+    app.bot_data["db_pool"] = db.get_pool(DB_PATH)
+
+    if QA_EMB_CACHE_MAX > 0:
+        emb_store = db.EmbeddingCache(DB_PATH, model_id(), max_rows=QA_EMB_CACHE_MAX)
+        try:
+            emb_store.prune()
+        except Exception:
+            logger.exception("Failed to prune the embedding cache; continuing.")
+        set_encode_store(emb_store)
+        app.bot_data["emb_store"] = emb_store
 
-    cache = QACache(DB_PATH, ttl=QA_CACHE_TTL)
+    cache = QACache(DB_PATH, ttl=QA_CACHE_TTL, emb_dtype=QA_EMB_DTYPE, index_type=QA_INDEX_TYPE)
     # Eagerly load cache once to surface DB errors early
     try:
         cache.force_reload()
@@ -1,128 +1,278 @@
+import os
 import threading
 import time
 import logging
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
 
 import db
+from match import embedded_rows, stack_embeddings, quantize_matrix
+from utils.ann_index import build_index
 
 logger = logging.getLogger(__name__)
 
+# upper bound on Q&A rows held in memory
+MAX_ROWS = 1000
+# above this fraction of changed rows a delta merge costs about as much as a full reload
+DELTA_MAX_FRACTION = 0.5
+
+class CacheSnapshot(NamedTuple):
+    """Immutable view of one cache load; replaced as a whole on every reload."""
+    qas: Tuple[Dict, ...]
+    embeddings: Tuple[Dict, ...]
+    emb_matrix: Optional[np.ndarray]
+    ids: Optional[np.ndarray]
+    emb_scales: Optional[np.ndarray]
+    by_id: Dict[int, Dict]
+    loaded_at: float
+    # db.get_change_marker() taken just before this load
+    marker: Optional[Tuple] = None
+    # optional ANN index over emb_matrix (see utils.ann_index)
+    index: Any = None
+    # question_norm column aligned with `ids`/`emb_matrix`; all the matcher reads per row
+    norms: Tuple[str, ...] = ()
+    # normalized question/variant text -> Q&A id, for the matcher's exact-hit shortcut
+    exact_ids: Dict[str, int] = {}
+    # rows of emb_matrix that hold an embedding (see match.embedded_rows)
+    valid: Optional[np.ndarray] = None
+
+_EMPTY_SNAPSHOT = CacheSnapshot((), (), None, None, None, {}, 0.0)
+
+def _norm_column(qas: Tuple[Dict, ...]) -> Tuple[str, ...]:
+    return tuple(q.get("question_norm") or q.get("question") or "" for q in qas)
+
+def _exact_ids(norms: Tuple[str, ...], ids: np.ndarray, embeddings: Tuple[Dict, ...], valid: np.ndarray, dim: int) -> Dict[str, int]:
+    # variants first so a Q&A's own question wins when both normalize the same;
+    # rows without a usable embedding are left out, as the matcher skips them too
+    exact = {e["norm"]: e["qa_id"] for e in embeddings if e.get("norm") and len(e["embedding"]) == dim}
+    exact.update((n, int(i)) for n, i, ok in zip(norms, ids, valid) if n and ok)
+    return exact
+
 class QACache:
-    def __init__(self, db_path: str, ttl: int = 30):
+    def __init__(self, db_path: str, ttl: int = 30, emb_dtype: str = "float32", index_type: str = "none"):
         self.db_path = db_path
         self.ttl = int(ttl)
+        self.emb_dtype = emb_dtype
+        self.index_type = index_type
+        self._pool = db.get_pool(db_path)
+        # guards reloads only; readers take `_snapshot` without locking
         self._lock = threading.Lock()
-        self._last_loaded = 0.0
-        self._qas: List[Dict] = []
-        self._embeddings: List[Dict] = []
+        self._snapshot: CacheSnapshot = _EMPTY_SNAPSHOT
         self._stop_event = threading.Event()
         self._auto_thread: Optional[threading.Thread] = None
+        # file stamp seen by the last auto-refresh; unchanged means nothing was written
+        self._last_stamp: Optional[Tuple] = None
 
     # -----------------------
     # Internal loader
     # -----------------------
+    @staticmethod
+    def _row_to_qa(r) -> Dict:
+        return {
+            "id": int(r["id"]),
+            "question": r["question"],
+            "question_norm": r["question_norm"],
+            "embedding": r["embedding"],
+            "answer": r["answer"],
+            "category": r["category"] or "",
+        }
+
     def _load_from_db(self) -> List[Dict]:
-        conn = db.connect(self.db_path)
-        if not conn:
-            logger.error("Failed to connect to database at %s", self.db_path)
-            return []
-        
-        try:
-            rows = db.list_all_qna(conn, limit=1000)
-            qas = []
-            for r in rows:
-                qas.append({
-                    "id": int(r["id"]),
-                    "question": r["question"],
-                    "question_norm": r["question_norm"],
-                    "embedding": r["embedding"],
-                    "answer": r["answer"],
-                    "category": r["category"] or "",
-                })
-            return qas
-        finally:
-            conn.close()
-    
+        with self._pool.acquire() as conn:
+            rows = db.list_all_qna(conn, limit=MAX_ROWS)
+            return [self._row_to_qa(r) for r in rows]
+
     def _load_embeddings(self) -> List[Dict]:
-        conn = db.connect(self.db_path)
-        if not conn:
-            logger.error("Failed to connect to database at %s", self.db_path)
-            return []
-        
-        try:
+        with self._pool.acquire() as conn:
             rows = db.load_all_embeddings(conn)
             embeddings = []
             for r in rows:
                 embeddings.append({
                     "qa_id": int(r["qa_id"]),
+                    "norm": r["norm"],
                     "embedding": r["embedding"],
                 })
             return embeddings
-        finally:
-            conn.close()
+
+    def _build_snapshot(self) -> CacheSnapshot:
+        """Load Q&A rows and embeddings and precompute the stacked, L2-normalized matrix."""
+        with self._pool.acquire() as conn:
+            marker = db.get_change_marker(conn)
+        qas = tuple(self._load_from_db())
+        embeddings = tuple(self._load_embeddings())
+        emb_matrix, emb_scales = quantize_matrix(stack_embeddings((q["embedding"] for q in qas), len(qas)), self.emb_dtype)
+        ids = np.fromiter((q["id"] for q in qas), dtype=np.int64, count=len(qas))
+        by_id = {q["id"]: q for q in qas}
+        index = build_index(emb_matrix, self.index_type, emb_scales)
+        norms = _norm_column(qas)
+        valid = embedded_rows(emb_matrix)
+        return CacheSnapshot(qas, embeddings, emb_matrix, ids, emb_scales, by_id, time.time(), marker, index, norms, _exact_ids(norms, ids, embeddings, valid, emb_matrix.shape[1]), valid)
+
+    def _build_delta(self, prev: CacheSnapshot) -> Optional[CacheSnapshot]:
+        """
+        Merge rows changed since `prev` into a new snapshot, decoding only their embeddings.
+        Deletions are found by diffing the id list. Returns None when a full reload is cheaper.
+        """
+        with self._pool.acquire() as conn:
+            marker = db.get_change_marker(conn)
+            live_ids = db.list_qna_ids(conn, limit=MAX_ROWS)
+            same = marker[:3] == prev.marker[:3] and live_ids == prev.ids.tolist()
+            # a write in the same second as the previous read would not move the marker
+            if same and prev.marker[0] < prev.marker[3]:
+                return prev._replace(loaded_at=time.time())
+            changed = {} if marker[0] is None else {
+                int(r["id"]): self._row_to_qa(r) for r in db.list_qna_updated_since(conn, prev.marker[0])
+            }
+
+        if len(changed) > DELTA_MAX_FRACTION * max(len(live_ids), 1):
+            return None
+
+        qas = []
+        keep_new, keep_prev, fresh = [], [], []
+        prev_pos = {qa_id: i for i, qa_id in enumerate(prev.ids.tolist())}
+        for i, qa_id in enumerate(live_ids):
+            qa = changed.get(qa_id)
+            if qa is None:
+                qa = prev.by_id.get(qa_id)
+                if qa is None:
+                    return None  # row we never saw without a newer timestamp
+                keep_new.append(i)
+                keep_prev.append(prev_pos[qa_id])
+            else:
+                fresh.append(i)
+            qas.append(qa)
+
+        fresh_matrix, fresh_scales = quantize_matrix(stack_embeddings((qas[i]["embedding"] for i in fresh), len(fresh)), self.emb_dtype)
+        dim = prev.emb_matrix.shape[1]
+        if fresh and fresh_matrix.shape[1] != dim:
+            return None
+
+        emb_matrix = np.empty((len(qas), dim), dtype=prev.emb_matrix.dtype)
+        emb_matrix[keep_new] = prev.emb_matrix[keep_prev]
+        emb_matrix[fresh] = fresh_matrix
+        emb_scales = None
+        if prev.emb_scales is not None:
+            emb_scales = np.empty(len(qas), dtype=np.float32)
+            emb_scales[keep_new] = prev.emb_scales[keep_prev]
+            emb_scales[fresh] = fresh_scales
+
+        # variants are not matched against the matrix; reload them only when anything moved
+        embeddings = tuple(self._load_embeddings())
+        qas = tuple(qas)
+        ids = np.fromiter(live_ids, dtype=np.int64, count=len(live_ids))
+        by_id = {q["id"]: q for q in qas}
+        index = build_index(emb_matrix, self.index_type, emb_scales)
+        norms = _norm_column(qas)
+        valid = embedded_rows(emb_matrix)
+        logger.info("QACache: merged %d changed row(s).", len(changed))
+        return CacheSnapshot(qas, embeddings, emb_matrix, ids, emb_scales, by_id, time.time(), marker, index, norms, _exact_ids(norms, ids, embeddings, valid, emb_matrix.shape[1]), valid)
+
+    def _reload(self) -> None:
+        """Build a new snapshot and publish it with a single attribute rebind (caller holds the lock)."""
+        prev = self._snapshot
+        snap = None
+        if prev.qas and prev.marker is not None and prev.marker[0] is not None and prev.emb_matrix.shape[1]:
+            snap = self._build_delta(prev)
+        self._snapshot = snap if snap is not None else self._build_snapshot()
 
     # -----------------------
     # Public API
     # -----------------------
-    def get_qas(self) -> List[Dict]:
-        """Return the cached Q&A list. Reloads if stale."""
-        with self._lock:
-            now = time.time()
-            if not self._qas or (now - self._last_loaded) > self.ttl:
+    def snapshot(self) -> CacheSnapshot:
+        """
+        Return the current snapshot, reloading first if it is stale or empty.
+        If another caller is already reloading a stale snapshot, return the stale one.
+        """
+        snap = self._snapshot
+        if snap.qas and (time.time() - snap.loaded_at) <= self.ttl:
+            return snap
+
+        # only one caller reloads; while it runs, everyone else keeps serving
+        # the stale snapshot. An empty cache has nothing to serve, so wait.
+        if not self._lock.acquire(blocking=not snap.qas):
+            return snap
+        try:
+            # another caller may have reloaded while we waited
+            snap = self._snapshot
+            if not snap.qas or (time.time() - snap.loaded_at) > self.ttl:
                 logger.info("QACache: reloading cache (ttl expired or empty).")
                 try:
-                    self._qas = self._load_from_db()
-                    self._last_loaded = now
+                    self._reload()
                 except Exception as e:
                     # keep old cache in case of DB error
                     logger.exception("QACache: failed to reload from DB: %s", e)
-            # return a shallow copy to prevent external mutation
-            return list(self._qas)
-    
-    def get_embeddings(self) -> List[Dict]:
-        """Return the cached embeddings. Reloads if stale."""
-        with self._lock:
-            now = time.time()
-            if not self._embeddings or (now - self._last_loaded) > self.ttl:
-                logger.info("QACache: reloading embeddings cache (ttl expired or empty).")
-                try:
-                    self._embeddings = self._load_embeddings()
-                    self._last_loaded = now
-                except Exception as e:
-                    # keep old cache in case of DB error
-                    logger.exception("QACache: failed to reload embeddings from DB: %s", e)
-            return list(self._embeddings)
+            return self._snapshot
+        finally:
+            self._lock.release()
+
+    def get_qas(self) -> Tuple[Dict, ...]:
+        """Return the cached Q&A rows (immutable tuple). Reloads if stale."""
+        return self.snapshot().qas
+
+    def get_embeddings(self) -> Tuple[Dict, ...]:
+        """Return the cached embeddings (immutable tuple). Reloads if stale."""
+        return self.snapshot().embeddings
+
+    def get_embedding_matrix(self) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        Return `(ids, matrix, scales)` where `matrix` is the (N, D) embedding matrix
+        aligned row-for-row with `get_qas()`, stored as `emb_dtype`.
+        `scales` holds per-row factors for int8 storage, else None.
+        Not copied — treat as read-only.
+        """
+        snap = self.snapshot()
+        return snap.ids, snap.emb_matrix, snap.emb_scales
+
+    def get_by_id(self, qa_id: int) -> Optional[Dict]:
+        """Return the cached Q&A with the given id, or None."""
+        return self._snapshot.by_id.get(qa_id)
 
     def invalidate(self) -> None:
         """Mark cache stale — next get_qas() will reload from DB."""
-        with self._lock:
-            logger.debug("QACache: invalidated by external request.")
-            self._last_loaded = 0
-            self._qas = []
-            self._embeddings = []
+        logger.debug("QACache: invalidated by external request.")
+        self._snapshot = _EMPTY_SNAPSHOT
 
     def force_reload(self) -> None:
         """Force immediate reload from DB."""
         with self._lock:
             logger.info("QACache: force reloading now.")
             try:
-                self._qas = self._load_from_db()
-                self._embeddings = self._load_embeddings()
-                self._last_loaded = time.time()
+                self._reload()
             except Exception:
                 logger.exception("QACache: force reload failed, keeping old cache.")
 
     # -----------------------
     # Auto-refresh background thread (optional)
     # -----------------------
+    def _db_stamp(self) -> Optional[Tuple]:
+        """
+        Return (mtime_ns, size) of the DB file and its WAL, or None if the DB can't be stat'ed.
+        In WAL mode commits land in the -wal file, so the main file alone isn't enough.
+        """
+        stamp = []
+        for path in (self.db_path, self.db_path + "-wal"):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                if path == self.db_path:
+                    return None
+                stamp.append(None)
+            else:
+                stamp.append((st.st_mtime_ns, st.st_size))
+        return tuple(stamp)
+
     def _auto_refresh_worker(self, interval: int):
         logger.info("QACache: auto-refresh thread started (interval=%s s).", interval)
         while not self._stop_event.wait(interval):
             try:
+                # taken before reloading so a write during the reload is seen next time
+                stamp = self._db_stamp()
+                if stamp is not None and stamp == self._last_stamp and self._snapshot.qas:
+                    continue
                 with self._lock:
-                    self._qas = self._load_from_db()
-                    self._embeddings = self._load_embeddings()
-                    self._last_loaded = time.time()
+                    self._reload()
+                self._last_stamp = stamp
                 logger.debug("QACache: auto-refreshed cache.")
             except Exception:
                 logger.exception("QACache: error during auto-refresh.")
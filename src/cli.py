@@ -4,15 +4,17 @@ Telegram FAQ Bot — CLI Utilities For Database Management
 """
 
 import argparse
+import logging
 import os
 
-from sentence_transformers import SentenceTransformer
-
 def download_model(model_name: str = "all-MiniLM-L6-v2") -> None:
     """
     Download and save the SentenceTransformer model to a local directory.
     This is useful for offline usage or to avoid downloading it every time.
     """
+    # imported here so --init/--migrate don't pay for loading torch
+    from sentence_transformers import SentenceTransformer
+
     if not os.path.exists("./models"):
         os.makedirs("./models")
     
@@ -36,12 +38,14 @@ def parse_args() -> argparse.Namespace:
         nargs=2,
         help="Seed Q&A and paraphrases from two JSON files: <qa.json> <paraphrases.json>"
     )
+    p.add_argument("-v", "--verbose", action="store_true", help="Log every seeded row")
     p.add_argument("--nlp", metavar="MODEL", nargs="?", const="all-MiniLM-L6-v2", help="Download and initialize NLP model (default: all-MiniLM-L6-v2)")
     return p.parse_args()
 
 
 def main() -> None:
     args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(message)s")
 
     # If neither --init nor --migrate nor --nlp is specified, show help
     if not args.init and not args.migrate and not args.nlp:
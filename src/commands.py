@@ -4,11 +4,16 @@ Telegram FAQ Bot — Command Handlers
 """
 
 import os
+import asyncio
 import logging
 import re
-from typing import Optional, List, Tuple
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Optional, List, Tuple
 
 from telegram import (
+    Chat,
     Update,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
@@ -29,108 +34,115 @@ from normalize import normalize_ar
 from utils.category import Category
 from utils.load_admins import load_admin_ids
 import db  # centralized DB service module (connect, add_qna, get_qna_by_id, ...)
-from utils.load_admins import load_admin_ids
 
-_MD_V2_PATTERN = re.compile(r'([_\*\[\]\(\)~`>#+\-=|{}\.!])')
+_MD_V2_TRANS = str.maketrans({c: "\\" + c for c in r"_*[]()~`>#+-=|{}.!"})
 logger = logging.getLogger(__name__)
-ADMIN_IDS = None
+# read once at import (.env is already loaded by `match` via `db`)
+ADMIN_IDS: frozenset = frozenset(load_admin_ids())
 
 def escape_markdown_v2(text: str) -> str:
     """Escape text for MarkdownV2 (safe for Arabic)."""
     if not text:
         return ""
-    return _MD_V2_PATTERN.sub(r'\\\1', text)
-
+    return text.translate(_MD_V2_TRANS)
 
-def _format_short_q(row_id: int, question: str, category: str) -> str:
-    category = Category.get_arabic(category) if category else "—"
-    # Escape dynamic parts
-    q_esc = escape_markdown_v2(question)
-    cat_esc = escape_markdown_v2(category)
 
-    # Shorten question for list view
-    short_raw = question if len(question) <= 80 else question[:77] + "…"
-    short_q = escape_markdown_v2(short_raw)
+def _format_short_q(row_id: int, short_q: str, category: str) -> str:
+    """`short_q` is the preview already truncated by db.list_recent_qna."""
+    category = (Category.get_arabic(category) or "") if category else "—"
+    # Escape dynamic parts in one pass; NUL is not escaped and never occurs in a category name
+    q_esc, _, cat_esc = (short_q + "\0" + category).translate(_MD_V2_TRANS).rpartition("\0")
 
-    return f"*\\#{row_id}*  —  {short_q}\n_التصنيف:_ {cat_esc}"
+    return f"*\\#{row_id}*  —  {q_esc}\n_التصنيف:_ {cat_esc}"
 
 
 def _format_full_q(row: dict) -> str:
-    category = Category.get_arabic(row.get("category")) if row.get("category") else "—"
-    q = escape_markdown_v2(row.get("question") or "")
-    a = escape_markdown_v2(row.get("answer") or "")
-    cat = escape_markdown_v2(category)
+    category = (Category.get_arabic(row.get("category")) or "") if row.get("category") else "—"
+    fused = ((row.get("question") or "") + "\0" + (row.get("answer") or "") + "\0" + category).translate(_MD_V2_TRANS)
+    head, _, cat = fused.rpartition("\0")
+    q, _, a = head.partition("\0")
 
     return f"*\\#Q{row.get('id')}*\n\n*السؤال:*\n{q}\n\n*الإجابة:*\n{a}\n\n*التصنيف:* {cat}"
 
 
+def _parse_cb_id(data: Optional[str]) -> Optional[int]:
+    """Id from callback data like "view::12"; None if malformed (handler patterns already pin the prefix)."""
+    _, sep, rest = (data or "").partition("::")
+    return int(rest) if sep and rest.isdecimal() else None
+
+
+def _parse_cb_arg(data: Optional[str]) -> Optional[str]:
+    """Payload after "::" in callback data like "addcat::FEES"; None if missing."""
+    _, sep, rest = (data or "").partition("::")
+    return rest if sep and rest else None
+
+
 def is_admin_private(update: Update) -> bool:
     """Return True only if the message is from a configured admin and in private chat."""
-    global ADMIN_IDS
-    if ADMIN_IDS is None:
-        ADMIN_IDS = load_admin_ids()
-
-    if update.effective_user is None or update.effective_chat is None:
-        return False
-    if update.effective_chat.type != "private":
-        return False
-    return update.effective_user.id in ADMIN_IDS
+    user = update.effective_user
+    chat = update.effective_chat
+    return user is not None and chat is not None and chat.type == "private" and user.id in ADMIN_IDS
 
 
 # -----------------------
 # Database wrapper helpers (use centralized db module)
 # -----------------------
-def _get_db_conn():
+def _checkout():
+    """Check out a connection from the process-wide pool (shared with the bot and QACache)."""
     db_path = os.getenv("DB_PATH")
     if not db_path:
         raise EnvironmentError("DB_PATH environment variable is not set")
-    return db.connect(db_path)
+    return db.get_pool(db_path).acquire()
+
+
+# bumped after every write made through these helpers; part of the get_qna_by_id cache key,
+# so a write orphans all cached rows at once (writes from other processes are not seen)
+_GEN = 0
+
+def _bump_gen() -> None:
+    global _GEN
+    _GEN += 1
 
 
 def insert_qna(question: str, answer: str, category: Optional[str]) -> int:
     """Insert or upsert a QnA using the centralized db service."""
-    conn = _get_db_conn()
-    try:
-        q_norm = normalize_ar(question)
-        return db.add_qna(conn, question, q_norm, answer, category)
-    finally:
-        conn.close()
+    q_norm = normalize_ar(question)
+    with _checkout() as conn:
+        qna_id = db.add_qna(conn, question, q_norm, answer, category)
+    _bump_gen()
+    return qna_id
 
 
-def list_qas(limit: int = 30, offset_id=0) -> List[Tuple[int, str, str]]:
-    conn = _get_db_conn()
-    try:
-        rows = db.list_all_qna(conn, limit=limit, offset_id=offset_id)
-    finally:
-        conn.close()
-    results = []
-    for r in rows:
-        results.append((r["id"], r["question"], r["category"] or ""))
-    return list(results)
+def list_qas(limit: int = 30) -> List[Tuple[int, str, str]]:
+    """Newest `limit` QnAs as (id, question preview, category), newest first."""
+    with _checkout() as conn:
+        rows = db.list_recent_qna(conn, limit=limit)
+    return [(r["id"], r["q_short"], r["category"]) for r in rows]
 
 
-def get_qna_by_id(qna_id: int) -> Optional[Tuple[int, str, str, str]]:
-    conn = _get_db_conn()
-    try:
+@lru_cache(maxsize=256)
+def _get_qna_by_id_cached(qna_id: int, gen: int) -> Optional[Tuple[int, str, str, str]]:
+    with _checkout() as conn:
         row = db.get_qna_by_id(conn, qna_id)
-    finally:
-        conn.close()
     if not row:
         return None
-    return (row["id"], row["question"], row["answer"], row["category"] or "")
+    return (row["id"], row["question"], row["answer"], row["category"])
+
 
+def get_qna_by_id(qna_id: int) -> Optional[Tuple[int, str, str, str]]:
+    return _get_qna_by_id_cached(qna_id, _GEN)
+
+
+# shorter text would prefix-match most of the table
+_MIN_SEARCH_LEN = 2
 
 def find_qas_by_text(text: str, limit: int = 10) -> List[Tuple[int, str, str]]:
-    """Search by text using centralized db.search_qna_by_question (uses LIKE on question/question_norm)."""
-    conn = _get_db_conn()
-    try:
-        rows = db.search_qna_by_question(conn, text)
-    finally:
-        conn.close()
-    results = []
-    for r in rows[:limit]:
-        results.append((r["id"], r["question"], r["category"] or ""))
-    return results
+    """Search by text using centralized db.search_qna_by_question (FTS prefix match on question/question_norm)."""
+    if len(text.strip()) < _MIN_SEARCH_LEN:
+        return []
+    with _checkout() as conn:
+        rows = db.search_qna_by_question(conn, text, limit=limit)
+    return [(r["id"], r["q_short"], r["category"]) for r in rows]
 
 
 def update_qna_field(qna_id: int, field: str, value: str) -> bool:
@@ -140,19 +152,17 @@ def update_qna_field(qna_id: int, field: str, value: str) -> bool:
     """
     if field not in {"question", "answer", "category"}:
         raise ValueError("Invalid field to update")
-    conn = _get_db_conn()
-    try:
-        return db.update_qna(conn, qna_id, field, value)
-    finally:
-        conn.close()
+    with _checkout() as conn:
+        ok = db.update_qna(conn, qna_id, field, value)
+    _bump_gen()
+    return ok
 
 
 def delete_qna_by_id(qna_id: int) -> bool:
-    conn = _get_db_conn()
-    try:
-        return db.delete_qna(conn, qna_id)
-    finally:
-        conn.close()
+    with _checkout() as conn:
+        ok = db.delete_qna(conn, qna_id)
+    _bump_gen()
+    return ok
 
 
 # -----------------------
@@ -162,10 +172,110 @@ ADD_Q, ADD_A, ADD_CAT = range(3)
 UPD_ID, UPD_FIELD, UPD_VAL = range(3, 6)
 DEL_ID, DEL_CONFIRM = range(6, 8)
 
+# handler filters & callback matching; payloads are validated by _parse_cb_id/_parse_cb_arg
+_TEXT_NOCMD = filters.TEXT & ~filters.COMMAND
+# admin commands are dropped by PTB before the handler runs; an empty ADMIN_IDS matches nobody
+_ADMIN_PRIVATE = filters.User(user_id=ADMIN_IDS) & filters.ChatType.PRIVATE
+_DEL_CONFIRM_PAT = re.compile(r"^del_(?:yes|no)$")
+# callback_data prefixes; the payload (an id or a Category name) is appended directly
+_CB_VIEW = "view::"
+_CB_CLOSE_VIEW = "close_view::"
+_CB_UPD = "upd_id::"
+_CB_DEL = "del_id::"
+_CB_UPDCHOOSE = "updchoose::"
+_CB_DELCHOOSE = "delchoose::"
+_CB_ADDCAT = "addcat::"
+_CB_UPDCAT = "updcat::"
+
+
+class PrefixCBHandler(CallbackQueryHandler):
+    """CallbackQueryHandler that matches on a fixed `prefix` of callback_data with str.startswith, no regex."""
+
+    __slots__ = ("prefix",)
+
+    def __init__(self, callback, prefix: str, **kwargs):
+        super().__init__(callback, **kwargs)
+        self.prefix = prefix
+
+    def check_update(self, update: object) -> bool:
+        if not isinstance(update, Update) or update.callback_query is None:
+            return False
+        data = update.callback_query.data
+        return isinstance(data, str) and data.startswith(self.prefix)
+
+
+# per-flow scratch state, one object per flow in context.user_data
+@dataclass(slots=True)
+class _AddState:
+    question: str = ""
+    answer: str = ""
+
+
+@dataclass(slots=True)
+class _UpdState:
+    qna_id: Optional[int] = None
+    field: Optional[str] = None
+
+
+@dataclass(slots=True)
+class _DelState:
+    qna_id: Optional[int] = None
+
+
+def _flow_state(context: ContextTypes.DEFAULT_TYPE, cls):
+    """Return this user's state object for the flow `cls`, creating it on first use."""
+    state = context.user_data.get(cls.__name__)
+    if state is None:
+        state = context.user_data[cls.__name__] = cls()
+    return state
+
+
+def _clear_flow_state(context: ContextTypes.DEFAULT_TYPE, cls) -> None:
+    context.user_data.pop(cls.__name__, None)
+
+
+# -----------------------
+# Static texts & keyboards (pure functions of Category; built once)
+# -----------------------
+_CATEGORIES_TEXT = "التصنيفات المتاحة:\n\n" + "\n".join(f"- {c}" for c in Category.get_all_arabic())
+_ADDCAT_KB = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(cat.value, callback_data=_CB_ADDCAT + cat.name)] for cat in Category]
+)
+_UPDCAT_KB = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(cat.value, callback_data=_CB_UPDCAT + cat.name)] for cat in Category]
+)
+_FIELD_MAP = {"السؤال": "question", "الإجابة": "answer", "الفئة": "category"}
+_FIELD_KB = ReplyKeyboardMarkup([list(_FIELD_MAP)], one_time_keyboard=True, resize_keyboard=True)
+_DEL_CONFIRM_KB = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton("✅ نعم", callback_data="del_yes"), InlineKeyboardButton("❌ لا", callback_data="del_no")]
+    ]
+)
+
 
 # -----------------------
 # /lookup @username
 # -----------------------
+# chat_id/username -> (fetched_at, Chat); spares the Bot API round trip on repeat lookups
+_LOOKUP_CACHE: Dict[object, Tuple[float, Chat]] = {}
+_LOOKUP_TTL = 300.0
+_LOOKUP_MAX = 256
+
+async def _get_chat_cached(context: ContextTypes.DEFAULT_TYPE, chat_id) -> Chat:
+    key = chat_id.lower() if isinstance(chat_id, str) else chat_id
+    now = time.monotonic()
+    cached = _LOOKUP_CACHE.get(key)
+    if cached and now - cached[0] < _LOOKUP_TTL:
+        return cached[1]
+    chat = await context.bot.get_chat(chat_id)
+    if len(_LOOKUP_CACHE) >= _LOOKUP_MAX:
+        # drop the oldest insertion
+        _LOOKUP_CACHE.pop(next(iter(_LOOKUP_CACHE)))
+    _LOOKUP_CACHE.pop(key, None)
+    _LOOKUP_CACHE[key] = (now, chat)
+    return chat
+
+
 async def lookup_username(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Usage: /lookup [@username]
@@ -188,7 +298,7 @@ async def lookup_username(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        user = await context.bot.get_chat(chat_id)
+        user = await _get_chat_cached(context, chat_id)
 
         text = (
             f"👤 *User Info*\n"
@@ -210,49 +320,70 @@ async def lookup_username(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # /categories command
 # -----------------------
 async def categories_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    cats = Category.get_all_arabic()
-    text = "التصنيفات المتاحة:\n\n" + "\n".join(f"- {c}" for c in cats)
-    await update.message.reply_text(text)
+    await update.message.reply_text(_CATEGORIES_TEXT)
 
 
 # -----------------------
 # /list_qas command (admin private only)
 # -----------------------
+_MSG_MAX_LEN = 4096
+_VIEW_BUTTONS_PER_ROW = 5
+
+def _qna_actions_kb(qna_id: int, closable: bool = False) -> InlineKeyboardMarkup:
+    sid = str(qna_id)
+    rows = [[
+        InlineKeyboardButton("تعديل 📝", callback_data=_CB_UPD + sid),
+        InlineKeyboardButton("حذف 🗑️", callback_data=_CB_DEL + sid),
+    ]]
+    if closable:
+        rows.append([InlineKeyboardButton("إغلاق ✖️", callback_data=_CB_CLOSE_VIEW + sid)])
+    return InlineKeyboardMarkup(rows)
+
+
+def _view_keyboard(ids: List[int]) -> InlineKeyboardMarkup:
+    buttons = [InlineKeyboardButton(f"#{_id}", callback_data=_CB_VIEW + str(_id)) for _id in ids]
+    return InlineKeyboardMarkup(
+        [buttons[i:i + _VIEW_BUTTONS_PER_ROW] for i in range(0, len(buttons), _VIEW_BUTTONS_PER_ROW)]
+    )
+
+
 async def list_qas_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin_private(update):
         await update.message.reply_text("هذا الأمر متاح للمشرفين فقط.")
         return
 
-    rows = list_qas(limit=30)
+    rows = await asyncio.to_thread(list_qas, 30)
     if not rows:
         await update.message.reply_text("لا توجد أسئلة مخزنة حالياً. ℹ️")
         return
 
+    # one message (split only past Telegram's length limit) instead of one per row;
+    # each row gets a "#id" button that opens the full view with edit/delete
+    footer = "⬆️ هذه أحدث الأسئلة اضغط على رقم السؤال لرؤية التفاصيل أو للتعديل/الحذف"
+    chunks: List[Tuple[List[str], List[int]]] = [([], [])]
+    size = len(footer)
     for _id, q, cat in rows:
-        text = _format_short_q(_id, q, cat)
-        kb = InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton("عرض 🔍", callback_data=f"view::{_id}"),
-                    InlineKeyboardButton("تعديل 📝", callback_data=f"upd_id::{_id}"),
-                    InlineKeyboardButton("حذف 🗑️", callback_data=f"del_id::{_id}"),
-                ]
-            ]
-        )
-        await update.message.reply_text(text, reply_markup=kb, parse_mode=ParseMode.MARKDOWN_V2)
-
-    await update.message.reply_text("⬆️ هذه أحدث الأسئلة اضغط على *عرض* لرؤية التفاصيل أو استخدم الأزرار للتعديل/الحذف", parse_mode=ParseMode.MARKDOWN_V2)
+        entry = _format_short_q(_id, q, cat)
+        if chunks[-1][0] and size + len(entry) + 2 > _MSG_MAX_LEN:
+            chunks.append(([], []))
+            size = len(footer)
+        chunks[-1][0].append(entry)
+        chunks[-1][1].append(_id)
+        size += len(entry) + 2
+
+    for i, (entries, ids) in enumerate(chunks):
+        text = "\n\n".join(entries)
+        if i == len(chunks) - 1:
+            text += "\n\n" + footer
+        await update.message.reply_text(text, reply_markup=_view_keyboard(ids), parse_mode=ParseMode.MARKDOWN_V2)
 
 async def view_qna_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    data = update.callback_query.data
-    try:
-        _, id_str = data.split("::", 1)
-        qna_id = int(id_str)
-    except Exception:
+    qna_id = _parse_cb_id(update.callback_query.data)
+    if qna_id is None:
         await update.callback_query.answer("خطأ في الطلب.")
         return
 
-    qna = get_qna_by_id(qna_id)
+    qna = await asyncio.to_thread(get_qna_by_id, qna_id)
     if not qna:
         await update.callback_query.answer("لم يتم العثور على هذا العنصر.")
         return
@@ -261,20 +392,10 @@ async def view_qna_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     row = {"id": _id, "question": question, "answer": answer, "category": category}
     text = _format_full_q(row)
 
-    kb = InlineKeyboardMarkup(
-        [
-            [
-                InlineKeyboardButton("تعديل 📝", callback_data=f"upd_id::{_id}"),
-                InlineKeyboardButton("حذف 🗑️", callback_data=f"del_id::{_id}"),
-            ],
-            [InlineKeyboardButton("إغلاق ✖️", callback_data=f"close_view::{_id}")],
-        ]
-    )
+    kb = _qna_actions_kb(_id, closable=True)
 
-    try:
-        await update.callback_query.edit_message_text(text, reply_markup=kb, parse_mode=ParseMode.MARKDOWN_V2)
-    except Exception:
-        await update.effective_message.reply_text(text, reply_markup=kb, parse_mode=ParseMode.MARKDOWN_V2)
+    # a new message, so the /list_qas listing it was opened from stays in place
+    await update.effective_message.reply_text(text, reply_markup=kb, parse_mode=ParseMode.MARKDOWN_V2)
 
     await update.callback_query.answer()
 
@@ -308,7 +429,7 @@ async def get_qna_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("الرجاء إدخال رقم معرف صالح.")
         return
 
-    qna = get_qna_by_id(qna_id)
+    qna = await asyncio.to_thread(get_qna_by_id, qna_id)
     if not qna:
         await update.message.reply_text(f"لم يتم العثور على QnA بالمعرف {qna_id}.")
         return
@@ -316,14 +437,7 @@ async def get_qna_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     _id, question, answer, category = qna
     row = {"id": _id, "question": question, "answer": answer, "category": category}
     text = _format_full_q(row)
-    kb = InlineKeyboardMarkup(
-        [
-            [
-                InlineKeyboardButton("تعديل 📝", callback_data=f"upd_id::{_id}"),
-                InlineKeyboardButton("حذف 🗑️", callback_data=f"del_id::{_id}"),
-            ]
-        ]
-    )
+    kb = _qna_actions_kb(_id)
     await update.message.reply_text(text, reply_markup=kb, parse_mode=ParseMode.MARKDOWN_V2)
 
 # -----------------------
@@ -338,17 +452,14 @@ async def add_qna_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def add_qna_receive_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["add_question"] = update.message.text.strip()
+    _flow_state(context, _AddState).question = update.message.text.strip()
     await update.message.reply_text("أرسل الإجابة الآن 🤖")
     return ADD_A
 
 
 async def add_qna_receive_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["add_answer"] = update.message.text.strip()
-    kb = InlineKeyboardMarkup(
-        [[InlineKeyboardButton(cat.value, callback_data=f"addcat::{cat.name}")] for cat in Category]
-    )
-    await update.message.reply_text("اختر الفئة:", reply_markup=kb)
+    _flow_state(context, _AddState).answer = update.message.text.strip()
+    await update.message.reply_text("اختر الفئة:", reply_markup=_ADDCAT_KB)
     return ADD_CAT
 
 
@@ -356,28 +467,25 @@ async def add_qna_category_cb(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not is_admin_private(update):
         await update.callback_query.answer("غير مسموح.")
         return ConversationHandler.END
-    data = update.callback_query.data
-    try:
-        _, cat_name = data.split("::", 1)
-    except Exception:
+    cat_name = _parse_cb_arg(update.callback_query.data)
+    if cat_name is None:
         await update.callback_query.answer("خطأ في اختيار الفئة.")
         return ConversationHandler.END
 
-    question = context.user_data.get("add_question")
-    answer = context.user_data.get("add_answer")
-    category_value = Category[cat_name].name if cat_name in Category.__members__ else Category.GENERAL.value
+    state = _flow_state(context, _AddState)
+    category = Category.parse(cat_name)
+    category_value = category.name if category else Category.GENERAL.value
 
-    qna_id = insert_qna(question, answer, category_value)
+    qna_id = await asyncio.to_thread(insert_qna, state.question, state.answer, category_value)
     
     # update the cache after a mutation
     qa_cache = context.application.bot_data.get("qa_cache")
     if qa_cache:
-        qa_cache.force_reload()
+        await asyncio.to_thread(qa_cache.force_reload)
         
     await update.callback_query.edit_message_text(f"تمت الإضافة بنجاح ✅\n**ID: {qna_id}**", parse_mode='Markdown')
     # clear temporary data
-    context.user_data.pop("add_question", None)
-    context.user_data.pop("add_answer", None)
+    _clear_flow_state(context, _AddState)
     return ConversationHandler.END
 
 
@@ -396,26 +504,27 @@ async def update_qna_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def update_qna_receive_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
-    qna_id = None
-    try:
+    if text.isdecimal() and len(text) < 12:
         qna_id = int(text)
-    except ValueError:
-        matches = find_qas_by_text(text, limit=5)
+    elif len(text) < _MIN_SEARCH_LEN:
+        await update.message.reply_text("أرسل نصاً أطول أو رقم المعرف.")
+        return UPD_ID
+    else:
+        matches = await asyncio.to_thread(find_qas_by_text, text, 5)
         if not matches:
             await update.message.reply_text("لم يتم العثور على نتيجة. حاول مرة أخرى أو أرسل /cancel.")
             return UPD_ID
         if len(matches) > 1:
             kb = InlineKeyboardMarkup(
-                [[InlineKeyboardButton(f"#{r[0]} — {r[1][:50]}…", callback_data=f"updchoose::{r[0]}")] for r in matches]
+                [[InlineKeyboardButton(f"#{r[0]} — {r[1]}…", callback_data=_CB_UPDCHOOSE + str(r[0]))] for r in matches]
             )
             await update.message.reply_text("اختيارات مطابقة — اختر واحد:", reply_markup=kb)
-            return UPD_FIELD
+            return UPD_ID
         else:
             qna_id = matches[0][0]
 
-    context.user_data["upd_qna_id"] = qna_id
-    kb = ReplyKeyboardMarkup([["السؤال", "الإجابة", "الفئة"]], one_time_keyboard=True, resize_keyboard=True)
-    await update.message.reply_text(f"تم اختيار **QnA #{qna_id}**. اختر ما تريد تعديله:", reply_markup=kb, parse_mode='Markdown')
+    _flow_state(context, _UpdState).qna_id = qna_id
+    await update.message.reply_text(f"تم اختيار **QnA #{qna_id}**. اختر ما تريد تعديله:", reply_markup=_FIELD_KB, parse_mode='Markdown')
     return UPD_FIELD
 
 
@@ -423,35 +532,27 @@ async def update_qna_choice_callback(update: Update, context: ContextTypes.DEFAU
     if not is_admin_private(update):
         await update.callback_query.answer("غير مسموح.")
         return ConversationHandler.END
-    data = update.callback_query.data
-    try:
-        _, id_str = data.split("::", 1)
-        qna_id = int(id_str)
-    except Exception:
+    qna_id = _parse_cb_id(update.callback_query.data)
+    if qna_id is None:
         await update.callback_query.answer("خطاء في الاختيار.")
         return ConversationHandler.END
 
-    context.user_data["upd_qna_id"] = qna_id
+    _flow_state(context, _UpdState).qna_id = qna_id
     await update.callback_query.edit_message_text(f"تم اختيار **QnA #{qna_id}**. الآن اختر الحقل لتعديله.", parse_mode='Markdown')
-    kb = ReplyKeyboardMarkup([["السؤال", "الإجابة", "الفئة"]], one_time_keyboard=True, resize_keyboard=True)
-    await update.effective_message.reply_text("اختر ما تريد تعديله:", reply_markup=kb)
+    await update.effective_message.reply_text("اختر ما تريد تعديله:", reply_markup=_FIELD_KB)
     return UPD_FIELD
 
 
 async def update_qna_field_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
-    map_field = {"السؤال": "question", "الإجابة": "answer", "الفئة": "category"}
-    if text not in map_field:
+    field = _FIELD_MAP.get(text)
+    if field is None:
         await update.message.reply_text("اختيار غير صحيح. أرسل /cancel لإنهاء.")
         return UPD_FIELD
-    field = map_field[text]
-    context.user_data["upd_field"] = field
+    _flow_state(context, _UpdState).field = field
 
     if field == "category":
-        kb = InlineKeyboardMarkup(
-            [[InlineKeyboardButton(cat.value, callback_data=f"updcat::{cat.name}")] for cat in Category]
-        )
-        await update.message.reply_text("اختر الفئة الجديدة:", reply_markup=kb)
+        await update.message.reply_text("اختر الفئة الجديدة:", reply_markup=_UPDCAT_KB)
         return UPD_VAL
     else:
         await update.message.reply_text(f"أرسل القيمة الجديدة لـ **{text}**:", parse_mode='Markdown')
@@ -459,19 +560,21 @@ async def update_qna_field_choice(update: Update, context: ContextTypes.DEFAULT_
 
 
 async def update_qna_receive_value(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    qna_id = int(context.user_data.get("upd_qna_id"))
-    field = context.user_data.get("upd_field")
+    state = _flow_state(context, _UpdState)
+    qna_id, field = state.qna_id, state.field
     new_value = update.message.text.strip()
-    ok = update_qna_field(qna_id, field, new_value)
+    if not new_value:
+        await update.message.reply_text("القيمة فارغة. أرسل القيمة الجديدة أو /cancel.")
+        return UPD_VAL
+    ok = await asyncio.to_thread(update_qna_field, qna_id, field, new_value)
     if ok:
         qa_cache = context.application.bot_data.get("qa_cache")
         if qa_cache:
-            qa_cache.force_reload()
+            await asyncio.to_thread(qa_cache.force_reload)
         await update.message.reply_text(f"تم التحديث بنجاح ✅", reply_markup=ReplyKeyboardRemove())
     else:
         await update.message.reply_text("لم يتم العثور على العنصر أو لم يحدث تغيير. ❌", reply_markup=ReplyKeyboardRemove())
-    context.user_data.pop("upd_qna_id", None)
-    context.user_data.pop("upd_field", None)
+    _clear_flow_state(context, _UpdState)
     return ConversationHandler.END
 
 
@@ -479,24 +582,23 @@ async def update_qna_category_cb(update: Update, context: ContextTypes.DEFAULT_T
     if not is_admin_private(update):
         await update.callback_query.answer("غير مسموح.")
         return ConversationHandler.END
-    try:
-        _, cat_name = update.callback_query.data.split("::", 1)
-    except Exception:
+    cat_name = _parse_cb_arg(update.callback_query.data)
+    if cat_name is None:
         await update.callback_query.answer("خطاء.")
         return ConversationHandler.END
 
-    qna_id = int(context.user_data.get("upd_qna_id"))
-    category_value = Category[cat_name].value if cat_name in Category.__members__ else Category.GENERAL.value
-    ok = update_qna_field(qna_id, "category", category_value)
+    qna_id = _flow_state(context, _UpdState).qna_id
+    category = Category.parse(cat_name)
+    category_value = category.value if category else Category.GENERAL.value
+    ok = await asyncio.to_thread(update_qna_field, qna_id, "category", category_value)
     if ok:
         qa_cache = context.application.bot_data.get("qa_cache")
         if qa_cache:
-            qa_cache.force_reload()
+            await asyncio.to_thread(qa_cache.force_reload)
         await update.callback_query.edit_message_text(f"تم التحديث بنجاح ✅")
     else:
         await update.callback_query.edit_message_text("فشل التحديث أو العنصر غير موجود. ❌")
-    context.user_data.pop("upd_qna_id", None)
-    context.user_data.pop("upd_field", None)
+    _clear_flow_state(context, _UpdState)
     return ConversationHandler.END
 
 
@@ -513,30 +615,27 @@ async def delete_qna_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def delete_qna_receive_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
-    qna_id = None
-    try:
+    if text.isdecimal() and len(text) < 12:
         qna_id = int(text)
-    except ValueError:
-        matches = find_qas_by_text(text, limit=5)
+    elif len(text) < _MIN_SEARCH_LEN:
+        await update.message.reply_text("أرسل نصاً أطول أو رقم المعرف.")
+        return DEL_ID
+    else:
+        matches = await asyncio.to_thread(find_qas_by_text, text, 5)
         if not matches:
             await update.message.reply_text("لم يتم العثور على نتيجة. حاول مرة أخرى أو أرسل /cancel.")
             return DEL_ID
         if len(matches) > 1:
             kb = InlineKeyboardMarkup(
-                [[InlineKeyboardButton(f"#{r[0]} — {r[1][:50]}…", callback_data=f"delchoose::{r[0]}")] for r in matches]
+                [[InlineKeyboardButton(f"#{r[0]} — {r[1]}…", callback_data=_CB_DELCHOOSE + str(r[0]))] for r in matches]
             )
             await update.message.reply_text("اختيارات مطابقة — اختر واحد:", reply_markup=kb)
-            return DEL_CONFIRM
+            return DEL_ID
         else:
             qna_id = matches[0][0]
 
-    context.user_data["del_qna_id"] = qna_id
-    kb = InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("✅ نعم", callback_data="del_yes"), InlineKeyboardButton("❌ لا", callback_data="del_no")]
-        ]
-    )
-    await update.message.reply_text(f"هل أنت متأكد من حذف **QnA #{qna_id}**؟", reply_markup=kb, parse_mode='Markdown')
+    _flow_state(context, _DelState).qna_id = qna_id
+    await update.message.reply_text(f"هل أنت متأكد من حذف **QnA #{qna_id}**؟", reply_markup=_DEL_CONFIRM_KB, parse_mode='Markdown')
     return DEL_CONFIRM
 
 
@@ -544,20 +643,13 @@ async def delete_qna_choice_callback(update: Update, context: ContextTypes.DEFAU
     if not is_admin_private(update):
         await update.callback_query.answer("غير مسموح.")
         return ConversationHandler.END
-    try:
-        _, id_str = update.callback_query.data.split("::", 1)
-        qna_id = int(id_str)
-    except Exception:
+    qna_id = _parse_cb_id(update.callback_query.data)
+    if qna_id is None:
         await update.callback_query.answer("خطأ في الاختيار.")
         return ConversationHandler.END
 
-    context.user_data["del_qna_id"] = qna_id
-    kb = InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("✅ نعم", callback_data="del_yes"), InlineKeyboardButton("❌ لا", callback_data="del_no")]
-        ]
-    )
-    await update.callback_query.edit_message_text(f"تم اختيار **QnA #{qna_id}**. هل أنت متأكد من الحذف؟", reply_markup=kb, parse_mode='Markdown')
+    _flow_state(context, _DelState).qna_id = qna_id
+    await update.callback_query.edit_message_text(f"تم اختيار **QnA #{qna_id}**. هل أنت متأكد من الحذف؟", reply_markup=_DEL_CONFIRM_KB, parse_mode='Markdown')
     return DEL_CONFIRM
 
 
@@ -568,19 +660,19 @@ async def delete_qna_confirm_cb(update: Update, context: ContextTypes.DEFAULT_TY
 
     choice = update.callback_query.data
     if choice == "del_yes":
-        qna_id = int(context.user_data.get("del_qna_id"))
-        ok = delete_qna_by_id(qna_id)
+        qna_id = _flow_state(context, _DelState).qna_id
+        ok = await asyncio.to_thread(delete_qna_by_id, qna_id)
         if ok:
             qa_cache = context.application.bot_data.get("qa_cache")
             if qa_cache:
-                qa_cache.force_reload()
+                await asyncio.to_thread(qa_cache.force_reload)
             await update.callback_query.edit_message_text("تم الحذف بنجاح ✅")
         else:
             await update.callback_query.edit_message_text("لم يتم العثور على العنصر. ❌")
     else:
         await update.callback_query.edit_message_text("تم إلغاء الحذف ❌")
 
-    context.user_data.pop("del_qna_id", None)
+    _clear_flow_state(context, _DelState)
     return ConversationHandler.END
 
 
@@ -596,17 +688,17 @@ def register_command_handlers(application):
 
     # categories and list (simple commands)
     application.add_handler(CommandHandler("categories", categories_cmd, filters=filters.ChatType.PRIVATE))
-    application.add_handler(CommandHandler("list_qas", list_qas_cmd))
-    application.add_handler(CommandHandler("get_qna", get_qna_cmd))
+    application.add_handler(CommandHandler("list_qas", list_qas_cmd, filters=_ADMIN_PRIVATE))
+    application.add_handler(CommandHandler("get_qna", get_qna_cmd, filters=_ADMIN_PRIVATE))
     application.add_handler(CommandHandler("lookup", lookup_username, filters=filters.TEXT & filters.ChatType.PRIVATE))
 
     # --- ADD QnA conversation handler ---
     add_conv = ConversationHandler(
-        entry_points=[CommandHandler("add_qna", add_qna_start)],
+        entry_points=[CommandHandler("add_qna", add_qna_start, filters=_ADMIN_PRIVATE)],
         states={
-            ADD_Q: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_qna_receive_question)],
-            ADD_A: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_qna_receive_answer)],
-            ADD_CAT: [CallbackQueryHandler(add_qna_category_cb, pattern=r"^addcat::")],
+            ADD_Q: [MessageHandler(_TEXT_NOCMD, add_qna_receive_question)],
+            ADD_A: [MessageHandler(_TEXT_NOCMD, add_qna_receive_answer)],
+            ADD_CAT: [PrefixCBHandler(add_qna_category_cb, _CB_ADDCAT)],
         },
         fallbacks=[],
         allow_reentry=True,
@@ -616,20 +708,21 @@ def register_command_handlers(application):
     # --- UPDATE QnA conversation handler ---
     upd_conv = ConversationHandler(
         entry_points=[
-            CommandHandler("update_qna", update_qna_start),
-            CallbackQueryHandler(update_qna_choice_callback, pattern=r"^upd_id::"),
+            CommandHandler("update_qna", update_qna_start, filters=_ADMIN_PRIVATE),
+            PrefixCBHandler(update_qna_choice_callback, _CB_UPD),
         ],
         states={
+            # the updchoose:: keyboard sent by update_qna_receive_id is answered in this state
             UPD_ID: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, update_qna_receive_id),
-                CallbackQueryHandler(update_qna_choice_callback, pattern=r"^updchoose::"),
+                MessageHandler(_TEXT_NOCMD, update_qna_receive_id),
+                PrefixCBHandler(update_qna_choice_callback, _CB_UPDCHOOSE),
             ],
             UPD_FIELD: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, update_qna_field_choice),
+                MessageHandler(_TEXT_NOCMD, update_qna_field_choice),
             ],
             UPD_VAL: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, update_qna_receive_value),
-                CallbackQueryHandler(update_qna_category_cb, pattern=r"^updcat::"),
+                MessageHandler(_TEXT_NOCMD, update_qna_receive_value),
+                PrefixCBHandler(update_qna_category_cb, _CB_UPDCAT),
             ],
         },
         fallbacks=[],
@@ -640,17 +733,17 @@ def register_command_handlers(application):
     # --- DELETE QnA conversation handler ---
     del_conv = ConversationHandler(
         entry_points=[
-            CommandHandler("delete_qna", delete_qna_start),
-            CallbackQueryHandler(delete_qna_choice_callback, pattern=r"^del_id::"),
+            CommandHandler("delete_qna", delete_qna_start, filters=_ADMIN_PRIVATE),
+            PrefixCBHandler(delete_qna_choice_callback, _CB_DEL),
         ],
         states={
+            # likewise for delchoose:: from delete_qna_receive_id
             DEL_ID: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, delete_qna_receive_id),
-                CallbackQueryHandler(delete_qna_choice_callback, pattern=r"^delchoose::"),
+                MessageHandler(_TEXT_NOCMD, delete_qna_receive_id),
+                PrefixCBHandler(delete_qna_choice_callback, _CB_DELCHOOSE),
             ],
             DEL_CONFIRM: [
-                CallbackQueryHandler(delete_qna_choice_callback, pattern=r"^del_id::"),
-                CallbackQueryHandler(delete_qna_confirm_cb, pattern=r"^del_(yes|no)$"),
+                CallbackQueryHandler(delete_qna_confirm_cb, pattern=_DEL_CONFIRM_PAT),
             ],
         },
         fallbacks=[],
@@ -662,6 +755,6 @@ def register_command_handlers(application):
     # application.add_handler(CallbackQueryHandler(pagination_callback, pattern=r"^(next_page::|start_page)"))
 
     # ensure callbacks for inline buttons are registered
-    application.add_handler(CallbackQueryHandler(view_qna_cb, pattern=r"^view::"))
-    application.add_handler(CallbackQueryHandler(close_view_cb, pattern=r"^close_view::"))
+    application.add_handler(PrefixCBHandler(view_qna_cb, _CB_VIEW))
+    application.add_handler(PrefixCBHandler(close_view_cb, _CB_CLOSE_VIEW))
 
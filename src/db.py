@@ -4,11 +4,15 @@ Telegram FAQ Bot — Centralized Database Service (SQLite)
 """
 
 from __future__ import annotations
+import hashlib
+import queue
 import sqlite3
-from typing import Any, List, Optional, Tuple, Dict
-from match import embed_text, load_embedding, embed_vector
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Tuple, Dict
+from match import embed_text, embed_texts, load_embedding, load_pickled_embedding, embed_vector, stack_embeddings, unit_vector
 from normalize import normalize_ar
-from utils.calc_score import calculate_score
 import numpy as np
 
 SCHEMA_QA = """
@@ -34,6 +38,16 @@ CREATE TABLE IF NOT EXISTS unanswered (
 );
 """
 
+SCHEMA_EMB_CACHE = """
+CREATE TABLE IF NOT EXISTS emb_cache (
+    model TEXT NOT NULL,
+    sha BLOB NOT NULL,
+    embedding BLOB NOT NULL,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (model, sha)
+) WITHOUT ROWID;
+"""
+
 SCHEMA_VARIANT = """
 CREATE TABLE IF NOT EXISTS qa_variant (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -55,6 +69,28 @@ SCHEMA_INDEXES = [
     "CREATE INDEX IF NOT EXISTS idx_variant_norm ON qa_variant(variant_norm)",
 ]
 
+# full-text index over qa questions, kept in sync by triggers (external content, no copy of the text)
+SCHEMA_QA_FTS = """
+CREATE VIRTUAL TABLE IF NOT EXISTS qa_fts USING fts5(
+    question, question_norm,
+    content='qa', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+SCHEMA_QA_FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS qa_fts_ai AFTER INSERT ON qa BEGIN
+        INSERT INTO qa_fts(rowid, question, question_norm) VALUES (new.id, new.question, new.question_norm);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS qa_fts_ad AFTER DELETE ON qa BEGIN
+        INSERT INTO qa_fts(qa_fts, rowid, question, question_norm) VALUES ('delete', old.id, old.question, old.question_norm);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS qa_fts_au AFTER UPDATE OF question, question_norm ON qa BEGIN
+        INSERT INTO qa_fts(qa_fts, rowid, question, question_norm) VALUES ('delete', old.id, old.question, old.question_norm);
+        INSERT INTO qa_fts(rowid, question, question_norm) VALUES (new.id, new.question, new.question_norm);
+    END""",
+]
+
 UNIQUE_CONSTRAINTS = [
     "CREATE UNIQUE INDEX IF NOT EXISTS uq_qa_question_norm ON qa(question_norm)",
 ]
@@ -62,35 +98,216 @@ UNIQUE_CONSTRAINTS = [
 # -------------------------------
 # Connection & Init
 # -------------------------------
-def connect(db_path: str) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
+_CONN_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-64000",
+    # qa_variant declares ON DELETE CASCADE, which SQLite only honours with this on
+    "PRAGMA foreign_keys=ON",
+)
+
+def _open_conn(db_path: str, check_same_thread: bool) -> sqlite3.Connection:
+    """Open a connection with the per-connection PRAGMAs applied once, at open time."""
+    conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
+    for pragma in _CONN_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+def connect(db_path: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    return _open_conn(db_path, check_same_thread)
+
+class ConnectionPool:
+    """Reusable SQLite connections for one database file, shared across threads."""
+
+    def __init__(self, db_path: str, size: int = 4):
+        self.db_path = db_path
+        self.size = int(size)
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=self.size)
+
+    def _open(self) -> sqlite3.Connection:
+        return _open_conn(self.db_path, check_same_thread=False)
+
+    @contextmanager
+    def acquire(self) -> Iterator[sqlite3.Connection]:
+        """Check out a connection; it is returned to the pool (or closed if full) afterwards."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_POOLS: Dict[str, ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_pool(db_path: str, size: int = 4) -> ConnectionPool:
+    """Return the process-wide connection pool for `db_path`, creating it on first use."""
+    with _POOLS_LOCK:
+        pool = _POOLS.get(db_path)
+        if pool is None:
+            pool = _POOLS[db_path] = ConnectionPool(db_path, size=size)
+        return pool
+
+# embedding BLOBs read better from larger pages; applied to existing files by _set_page_size
+PAGE_SIZE = 8192
+
 def init_db(conn: sqlite3.Connection) -> None:
+    _set_page_size(conn)
     cur = conn.cursor()
     cur.execute(SCHEMA_QA)
     cur.execute(SCHEMA_UNANSWERED)
     cur.execute(SCHEMA_VARIANT)
+    cur.execute(SCHEMA_EMB_CACHE)
     for stmt in SCHEMA_INDEXES:
         cur.execute(stmt)
     for stmt in UNIQUE_CONSTRAINTS:
         cur.execute(stmt)
+    _init_fts(cur)
+    _migrate(cur)
     conn.commit()
 
+# bumped with each one-off data migration below; stored in PRAGMA user_version
+SCHEMA_VERSION = 2
+
+def _migrate(cur: sqlite3.Cursor) -> None:
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    if version < 1:
+        _migrate_pickled_embeddings(cur)
+    if version < 2:
+        _migrate_unit_embeddings(cur)
+    if version < SCHEMA_VERSION:
+        cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def _migrate_pickled_embeddings(cur: sqlite3.Cursor) -> None:
+    """
+    Rewrite pickled-ndarray embeddings as raw float32 bytes.
+    pickle ignores trailing bytes, so a raw blob can occasionally "unpickle" into junk; only
+    finite 1-D vectors of the corpus' common dimension are rewritten, anything else is left alone.
+    """
+    decoded = {}
+    dims = Counter()
+    for table in ("qa", "qa_variant"):
+        for row_id, blob in cur.execute(f"SELECT id, embedding FROM {table}").fetchall():
+            if blob is None:
+                continue
+            try:
+                vec = load_pickled_embedding(blob)
+            except Exception:
+                dims[len(blob) // 4] += 1  # already raw bytes
+                continue
+            if vec.ndim == 1 and len(vec) and np.isfinite(vec).all():
+                decoded[(table, row_id)] = vec
+                dims[len(vec)] += 1
+    if not decoded:
+        return
+    dim = dims.most_common(1)[0][0]
+    for table in ("qa", "qa_variant"):
+        updates = [(vec.tobytes(), row_id) for (t, row_id), vec in decoded.items() if t == table and len(vec) == dim]
+        cur.executemany(f"UPDATE {table} SET embedding = ? WHERE id = ?", updates)
+
+def _migrate_unit_embeddings(cur: sqlite3.Cursor) -> None:
+    """L2-normalize embeddings stored before embed_text started writing unit vectors."""
+    for table in ("qa", "qa_variant"):
+        rows = cur.execute(f"SELECT id, embedding FROM {table}").fetchall()
+        updates = []
+        for row_id, blob in rows:
+            vec = load_embedding(blob)
+            if len(vec) and not np.isclose(np.linalg.norm(vec), 1.0, atol=1e-4):
+                updates.append((unit_vector(vec).tobytes(), row_id))
+        cur.executemany(f"UPDATE {table} SET embedding = ? WHERE id = ?", updates)
+
+def _set_page_size(conn: sqlite3.Connection) -> None:
+    """
+    Rebuild the file with PAGE_SIZE pages if it uses smaller ones. One-off: a no-op once applied.
+    WAL files keep their page size, so the rebuild runs with a rollback journal and then switches back.
+    """
+    if conn.execute("PRAGMA page_size").fetchone()[0] >= PAGE_SIZE:
+        return
+    conn.commit()
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.execute(f"PRAGMA page_size={PAGE_SIZE}")
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA journal_mode=WAL")
+
+def _init_fts(cur: sqlite3.Cursor) -> None:
+    """Create the FTS index and its triggers; index existing rows the first time. No-op without FTS5."""
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'qa_fts'")
+    existed = cur.fetchone() is not None
+    try:
+        cur.execute(SCHEMA_QA_FTS)
+    except sqlite3.OperationalError:
+        # sqlite built without FTS5; search falls back to LIKE
+        return
+    for stmt in SCHEMA_QA_FTS_TRIGGERS:
+        cur.execute(stmt)
+    if not existed:
+        cur.execute("INSERT INTO qa_fts(qa_fts) VALUES ('rebuild')")
+
 # -------------------------------
 # CRUD Operations for QA
 # -------------------------------
-def add_qna(conn: sqlite3.Connection, question: str, question_norm: str, answer: str, category: str) -> int:
-    embedding = embed_text(question_norm)
+@contextmanager
+def write_txn(conn: sqlite3.Connection) -> Iterator[sqlite3.Cursor]:
+    """
+    Run the enclosed writes as one BEGIN IMMEDIATE transaction (one commit, write lock taken up front).
+    Inside an already open transaction it just yields a cursor and leaves the commit to the caller.
+    """
     cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO qa (question, embedding, question_norm, answer, category)
-        VALUES (?, ?, ?, ?, ?)
-    """, (question, embedding, question_norm, answer, category))
+    if conn.in_transaction:
+        yield cur
+        return
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        yield cur
+    except BaseException:
+        conn.rollback()
+        raise
     conn.commit()
+
+def add_qna(conn: sqlite3.Connection, question: str, question_norm: str, answer: str, category: str) -> int:
+    embedding = embed_text(question_norm)
+    with write_txn(conn) as cur:
+        cur.execute("""
+            INSERT INTO qa (question, embedding, question_norm, answer, category)
+            VALUES (?, ?, ?, ?, ?)
+        """, (question, embedding, question_norm, answer, category))
     return cur.lastrowid
 
+def add_qna_many(conn: sqlite3.Connection, rows: List[Tuple[str, str, str, Optional[str]]]) -> List[Optional[int]]:
+    """
+    Insert `(question, question_norm, answer, category)` rows in one transaction,
+    embedding all questions in a single batched model call.
+    Returns the new id per row, or None where the normalized question already exists.
+    """
+    embeddings = embed_texts([r[1] for r in rows])
+    ids: List[Optional[int]] = []
+    with write_txn(conn) as cur:
+        for (question, question_norm, answer, category), embedding in zip(rows, embeddings):
+            cur.execute("""
+                INSERT OR IGNORE INTO qa (question, embedding, question_norm, answer, category)
+                VALUES (?, ?, ?, ?, ?)
+            """, (question, embedding, question_norm, answer, category))
+            ids.append(cur.lastrowid if cur.rowcount > 0 else None)
+    return ids
+
 def update_qna(conn: sqlite3.Connection, qna_id: int, field: str, value: str) -> bool:
     if field not in {"question", "answer", "category"}:
         raise ValueError(f"Invalid field: {field}")
@@ -102,34 +319,38 @@ def update_qna(conn: sqlite3.Connection, qna_id: int, field: str, value: str) ->
         question_norm = normalize_ar(value)
         embedding = embed_text(question_norm)
 
-    cur = conn.cursor()
-    if field == "question":
-        cur.execute(f"""
-            UPDATE qa
-            SET {field} = ?, question_norm = ?, embedding = ?, last_updated = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (value, question_norm, embedding, qna_id))
-
-        cur.execute("DELETE FROM qa_variant WHERE qa_id = ?", (qna_id,))
-        #TODO: regenerate variants for the updated question
-    else:
-        cur.execute(f"""
-            UPDATE qa
-            SET {field} = ?, last_updated = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (value, qna_id))
-    conn.commit()
-    return cur.rowcount > 0
+    with write_txn(conn) as cur:
+        if field == "question":
+            cur.execute(f"""
+                UPDATE qa
+                SET {field} = ?, question_norm = ?, embedding = ?, last_updated = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (value, question_norm, embedding, qna_id))
+            updated = cur.rowcount > 0
+
+            cur.execute("DELETE FROM qa_variant WHERE qa_id = ?", (qna_id,))
+            #TODO: regenerate variants for the updated question
+        else:
+            cur.execute(f"""
+                UPDATE qa
+                SET {field} = ?, last_updated = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (value, qna_id))
+            updated = cur.rowcount > 0
+    return updated
 
 def delete_qna(conn: sqlite3.Connection, qna_id: int) -> bool:
-    cur = conn.cursor()
-    cur.execute("DELETE FROM qa WHERE id = ?", (qna_id,))
-    conn.commit()
+    with write_txn(conn) as cur:
+        cur.execute("DELETE FROM qa WHERE id = ?", (qna_id,))
     return cur.rowcount > 0
 
 def get_qna_by_id(conn: sqlite3.Connection, qna_id: int) -> Optional[sqlite3.Row]:
+    """Row without the embedding blob; `category` is '' when unset."""
     cur = conn.cursor()
-    cur.execute("SELECT * FROM qa WHERE id = ?", (qna_id,))
+    cur.execute("""
+        SELECT id, question, question_norm, answer, COALESCE(category, '') AS category, last_updated
+        FROM qa WHERE id = ?
+    """, (qna_id,))
     return cur.fetchone()
 
 def get_qna_by_question(conn: sqlite3.Connection, question: str) -> Optional[sqlite3.Row]:
@@ -142,38 +363,114 @@ def get_qna_by_question(conn: sqlite3.Connection, question: str) -> Optional[sql
         re = cur.fetchone()
     return re
 
-def search_qna_by_question(conn: sqlite3.Connection, search_term: str) -> List[sqlite3.Row]:
+def _fts_query(search_term: str) -> str:
+    """Turn free text into an FTS5 query: every normalized word as a quoted prefix term (AND-ed)."""
+    return " ".join('"' + tok.replace('"', '""') + '"*' for tok in normalize_ar(search_term).split())
+
+def search_qna_by_question(conn: sqlite3.Connection, search_term: str, limit: int = 10, preview_len: int = 50) -> List[sqlite3.Row]:
+    """
+    Rows (id, q_short, category) whose question words start with the search words, best first.
+    `q_short` is the first `preview_len` chars of the question.
+    """
+    query = _fts_query(search_term)
+    if not query:
+        return []
     cur = conn.cursor()
-    cur.execute("""
-        SELECT * FROM qa
-        WHERE question LIKE ? OR question_norm LIKE ?
-        ORDER BY last_updated DESC
-    """, (f"%{search_term}%", f"%{search_term}%"))
+    try:
+        cur.execute("""
+            SELECT q.id, substr(q.question, 1, ?) AS q_short, COALESCE(q.category, '') AS category FROM qa_fts f
+            JOIN qa q ON q.id = f.rowid
+            WHERE qa_fts MATCH ?
+            ORDER BY f.rank
+            LIMIT ?
+        """, (preview_len, query, limit))
+    except sqlite3.OperationalError:
+        # no FTS5 / index not created yet (run --init)
+        cur.execute("""
+            SELECT id, substr(question, 1, ?) AS q_short, COALESCE(category, '') AS category FROM qa
+            WHERE question LIKE ? OR question_norm LIKE ?
+            ORDER BY last_updated DESC
+            LIMIT ?
+        """, (preview_len, f"%{search_term}%", f"%{search_term}%", limit))
     return cur.fetchall()
 
-def semantic_search(conn: sqlite3.Connection, query: str, top_k: int = 1):
+def semantic_search(conn: sqlite3.Connection, query: str, top_k: int = 1, corpus: Optional[Tuple[np.ndarray, np.ndarray]] = None):
+    """
+    Embedding-only ranking of Q&As (questions and variants) for `query`: up to `top_k`
+    `(score, {"qa_id": id})` pairs, best first. `corpus` is a `load_embedding_matrix` result
+    to reuse across queries; without it the matrix is loaded from `conn`.
+    """
     query_emb = embed_vector(query)
     if query_emb is None or len(query_emb) == 0:
         return []
 
-    embeddings = load_all_embeddings(conn)
-    if not embeddings:
+    matrix, ids = corpus if corpus is not None else load_embedding_matrix(conn)
+    if not len(ids) or matrix.shape[1] != len(query_emb):
         return []
 
-    scored = []
-    for row in embeddings:
-        score = calculate_score(query_emb, row["embedding"])
-        scored.append((score, row))
-
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return scored[:top_k]
+    # rows are unit length, so one matrix-vector product gives every cosine
+    cos = matrix @ unit_vector(query_emb)
+    scores = np.clip(cos * 100, 0.0, 100.0)
+
+    # variants repeat their Q&A's id; keep each Q&A's best row so top_k counts distinct Q&As
+    qa_ids, rows = np.unique(ids, return_inverse=True)
+    best = np.full(len(qa_ids), -1.0, dtype=scores.dtype)
+    np.maximum.at(best, rows, scores)
+
+    # best top_k in O(N); only those few get sorted
+    if top_k == 1:
+        order = [int(best.argmax())]
+    elif top_k < len(best):
+        order = np.argpartition(-best, top_k)[:top_k]
+        order = order[np.argsort(-best[order], kind="stable")]
+    else:
+        order = np.argsort(-best, kind="stable")
+    return [(float(best[i]), {"qa_id": int(qa_ids[i])}) for i in order]
 
 def list_all_qna(conn: sqlite3.Connection, limit: int = 30, offset_id: int = 0) -> List[sqlite3.Row]:
     cur = conn.cursor()
     cur.execute("SELECT * FROM qa WHERE id > ? ORDER BY id ASC LIMIT ?", (offset_id, limit))
     return cur.fetchall()
 
+def list_recent_qna(conn: sqlite3.Connection, limit: int = 30, preview_len: int = 80) -> List[sqlite3.Row]:
+    """
+    Newest `limit` rows as (id, q_short, category), newest first.
+    `q_short` is the question cut to `preview_len` chars (ending in "…") by SQLite.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id,
+               CASE WHEN length(question) > :n THEN substr(question, 1, :n - 3) || '…' ELSE question END AS q_short,
+               COALESCE(category, '') AS category
+        FROM qa ORDER BY id DESC LIMIT :limit
+    """, {"n": preview_len, "limit": limit})
+    return cur.fetchall()
+
+def list_qna_ids(conn: sqlite3.Connection, limit: int = 30) -> List[int]:
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM qa ORDER BY id ASC LIMIT ?", (limit,))
+    return [row["id"] for row in cur.fetchall()]
 
+def list_qna_updated_since(conn: sqlite3.Connection, since: str) -> List[sqlite3.Row]:
+    """Rows whose last_updated is at or after `since` (inclusive, timestamps have 1s resolution)."""
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM qa WHERE last_updated >= ? ORDER BY id ASC", (since,))
+    return cur.fetchall()
+
+def get_change_marker(conn: sqlite3.Connection) -> Tuple[Optional[str], int, Optional[str], str]:
+    """
+    Return (max qa.last_updated, variant count, max qa_variant.last_updated, current timestamp)
+    for change detection. The current timestamp tells whether the newest write may share its second.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT (SELECT MAX(last_updated) FROM qa),
+               (SELECT COUNT(*) FROM qa_variant),
+               (SELECT MAX(last_updated) FROM qa_variant),
+               CURRENT_TIMESTAMP
+    """)
+    row = cur.fetchone()
+    return row[0], row[1], row[2], row[3]
 
 # -------------------------------
 # Variants
@@ -188,6 +485,27 @@ def add_variant(conn, qa_id: int, variant: str, variant_norm: str) -> int:
     conn.commit()
     return cur.lastrowid
 
+def add_variants_many(conn: sqlite3.Connection, rows: List[Tuple[int, str, str]]) -> int:
+    """
+    Insert `(qa_id, variant, variant_norm)` rows with one batched encode, one executemany
+    and a single commit. Existing (qa_id, variant_norm) pairs are ignored. Returns rows inserted.
+    """
+    if not rows:
+        return 0
+    embeddings = embed_texts([r[2] for r in rows])
+    with write_txn(conn) as cur:
+        cur.executemany("""
+            INSERT OR IGNORE INTO qa_variant (qa_id, variant, variant_norm, embedding)
+            VALUES (?, ?, ?, ?)
+        """, [(qa_id, variant, variant_norm, embedding) for (qa_id, variant, variant_norm), embedding in zip(rows, embeddings)])
+    return cur.rowcount
+
+def list_variant_keys(conn: sqlite3.Connection) -> set:
+    """Every existing (qa_id, variant_norm) pair."""
+    cur = conn.cursor()
+    cur.execute("SELECT qa_id, variant_norm FROM qa_variant")
+    return {(row[0], row[1]) for row in cur}
+
 def list_variants_for_qa(conn, qa_id: int):
     cur = conn.cursor()
     cur.execute("SELECT * FROM qa_variant WHERE qa_id = ?", (qa_id,))
@@ -200,17 +518,111 @@ def load_all_embeddings(conn: sqlite3.Connection) -> List[Dict[str, bytes | str]
         "qa_id": row["qa_id"],
         "norm": row["question_norm"],
         "embedding": load_embedding(row["embedding"]),
-    } for row in cur.fetchall()]
+    } for row in cur]
 
     cur.execute("SELECT qa_id, variant_norm, embedding FROM qa_variant")
     res.extend([{
         "qa_id": row["qa_id"],
         "norm": row["variant_norm"],
         "embedding": load_embedding(row["embedding"]),
-    } for row in cur.fetchall()])
+    } for row in cur])
 
     return res
 
+def load_embedding_matrix(conn: sqlite3.Connection) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return `(matrix, qa_ids)`: every question and variant embedding as one L2-normalized
+    (N, D) float32 matrix, and the Q&A id each row belongs to (variants repeat their Q&A's id).
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id AS qa_id, embedding FROM qa
+        UNION ALL
+        SELECT qa_id, embedding FROM qa_variant
+    """)
+    # stream rows off the cursor; only the blobs are kept until the matrix is filled
+    ids: List[int] = []
+
+    def blobs() -> Iterator[bytes]:
+        for qa_id, blob in cur:
+            ids.append(qa_id)
+            yield blob
+
+    matrix = stack_embeddings(blobs())
+    return matrix, np.array(ids, dtype=np.int64)
+
+# -------------------------------
+# Persistent embedding cache
+# -------------------------------
+class EmbeddingCache:
+    """
+    text -> embedding bytes kept in the `emb_cache` table across restarts, namespaced by `model`
+    so switching models never serves stale vectors. Plugged into match via set_encode_store().
+    Lookups only read; new rows and `last_used` refreshes are buffered in memory and written
+    by `flush()`, which the caller runs off the event loop.
+    """
+
+    def __init__(self, db_path: str, model: str, max_rows: int = 10000):
+        self.model = model
+        self.max_rows = int(max_rows)
+        self._pool = get_pool(db_path)
+        # guards the write-behind buffers below
+        self._lock = threading.Lock()
+        self._pending: Dict[bytes, bytes] = {}
+        self._touched: set = set()
+
+    @staticmethod
+    def _sha(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def get(self, text: str) -> Optional[bytes]:
+        sha = self._sha(text)
+        with self._lock:
+            blob = self._pending.get(sha)
+        if blob is not None:
+            return blob
+        with self._pool.acquire() as conn:
+            row = conn.execute("SELECT embedding FROM emb_cache WHERE model = ? AND sha = ?", (self.model, sha)).fetchone()
+        if row is None:
+            return None
+        with self._lock:
+            self._touched.add(sha)
+        return bytes(row[0])
+
+    def put(self, text: str, embedding: bytes) -> None:
+        with self._lock:
+            self._pending[self._sha(text)] = embedding
+
+    def flush(self) -> int:
+        """Write buffered rows and `last_used` refreshes in one transaction; returns rows written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            touched, self._touched = self._touched - pending.keys(), set()
+        if not pending and not touched:
+            return 0
+        with self._pool.acquire() as conn, write_txn(conn) as cur:
+            cur.executemany("""
+                INSERT OR REPLACE INTO emb_cache (model, sha, embedding, last_used)
+                VALUES (?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+            """, [(self.model, sha, blob) for sha, blob in pending.items()])
+            cur.executemany("""
+                UPDATE emb_cache SET last_used = CAST(strftime('%s', 'now') AS INTEGER)
+                WHERE model = ? AND sha = ?
+            """, [(self.model, sha) for sha in touched])
+        return len(pending) + len(touched)
+
+    def prune(self) -> int:
+        """Drop this model's least recently used rows beyond `max_rows`, and every other model's rows."""
+        with self._pool.acquire() as conn, write_txn(conn) as cur:
+            cur.execute("DELETE FROM emb_cache WHERE model != ?", (self.model,))
+            removed = cur.rowcount
+            cur.execute("""
+                DELETE FROM emb_cache WHERE model = ? AND sha NOT IN (
+                    SELECT sha FROM emb_cache WHERE model = ? ORDER BY last_used DESC LIMIT ?
+                )
+            """, (self.model, self.model, self.max_rows))
+            return removed + cur.rowcount
+
 # -------------------------------
 # Unanswered Questions
 # -------------------------------
@@ -223,6 +635,16 @@ def log_unanswered(conn: sqlite3.Connection, user_id: int, question: str, questi
     conn.commit()
     return cur.lastrowid
 
+def log_unanswered_many(conn: sqlite3.Connection, rows: List[Tuple[Optional[int], str, str]]) -> int:
+    """Insert many (user_id, question, question_norm) rows in one transaction."""
+    cur = conn.cursor()
+    cur.executemany("""
+        INSERT INTO unanswered (user_id, question, question_norm)
+        VALUES (?, ?, ?)
+    """, rows)
+    conn.commit()
+    return cur.rowcount
+
 def mark_unanswered_handled(conn: sqlite3.Connection, unanswered_id: int) -> bool:
     cur = conn.cursor()
     cur.execute("UPDATE unanswered SET handled = 1 WHERE id = ?", (unanswered_id,))
@@ -1,5 +1,16 @@
-from db import list_all_qna, connect
-from match import find_best_match
+import argparse
+import time
+
+import numpy as np
+
+from db import list_all_qna, connect, load_embedding_matrix, semantic_search
+from match import find_best_match_batch, find_best_match_columns, stack_embeddings
+from normalize import normalize_ar
+
+p = argparse.ArgumentParser(description="Top-1 accuracy of the matcher on a few labelled questions")
+p.add_argument("--top-k", type=int, metavar="K", default=0, help="Also report embedding-only recall@K over questions and variants")
+p.add_argument("--bench", type=int, metavar="N", default=0, help="Also time N rounds of single-query matching and print queries/sec")
+args = p.parse_args()
 
 conn = connect('./faq.db')
 try:
@@ -15,6 +26,8 @@ try:
             "answer": r["answer"],
             "category": r["category"] or "",
         })
+    # questions and variants as one matrix, loaded once for every --top-k query
+    corpus = load_embedding_matrix(conn) if args.top_k else None
 finally:
     conn.close()
 
@@ -23,9 +36,34 @@ tests = [
   {"q": "حاجه اذاكر منها", "gold": 44},
 ]
 
+# decode and normalize the corpus once, not once per test question
+emb_matrix = stack_embeddings(qa["embedding"] for qa in qas)
+
+# every test question is encoded in one batched model call
+results = find_best_match_batch([t["q"] for t in tests], qas, emb_matrix)
+
 hits = 0
-for t in tests:
-    res = find_best_match(t["q"], qas)
+for t, res in zip(tests, results):
     print(res)
     hits += int(res and res["qa_id"] == t["gold"])
-print("Top-1 accuracy:", hits/len(tests))
\ No newline at end of file
+print("Top-1 accuracy:", hits/len(tests))
+
+if args.top_k:
+    found = 0
+    for t in tests:
+        ranked = semantic_search(None, normalize_ar(t["q"]), args.top_k, corpus=corpus)
+        found += int(any(hit["qa_id"] == t["gold"] for _, hit in ranked))
+    print(f"Semantic recall@{args.top_k}:", found/len(tests))
+
+if args.bench:
+    # same hot path as the bot: column inputs built once, one find_best_match_columns per message.
+    # After the first round the encode cache answers, so this times scoring rather than the model.
+    ids = np.fromiter((qa["id"] for qa in qas), dtype=np.int64, count=len(qas))
+    norms = [qa["question_norm"] for qa in qas]
+    queries = [normalize_ar(t["q"]) for t in tests]
+    start = time.perf_counter()
+    for _ in range(args.bench):
+        for q in queries:
+            find_best_match_columns(q, ids, norms, emb_matrix)
+    elapsed = time.perf_counter() - start
+    print(f"{args.bench * len(queries) / elapsed:.1f} queries/sec ({args.bench} rounds x {len(queries)} queries)")
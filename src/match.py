@@ -5,106 +5,308 @@ Telegram FAQ Bot — Matching User Queries to Answers
 from __future__ import annotations
 
 import os
-from typing import List, Optional, Dict, Any
+from typing import Iterable, List, Mapping, Optional, Dict, Any, Sequence, Tuple
 
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
 import pickle
 import numpy as np
 from functools import lru_cache
 import logging
 
 from normalize import normalize_ar
-from utils.calc_score import calculate_scores, calculate_score
+from utils.calc_score import calculate_batch_scores, calculate_multi_scores
+from utils import ann_index
 
 # load .env if present
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+def model_id() -> str:
+    """Name of the configured model plus any ONNX export; different ids may give different vectors."""
+    model_name = os.getenv("NLP_MODEL_NAME", "paraphrase-multilingual-MiniLM-L12-v2")
+    onnx_file = os.getenv("NLP_ONNX_FILE") if os.getenv("NLP_BACKEND", "torch").lower() == "onnx" else None
+    return f"{model_name}/{onnx_file}" if onnx_file else model_name
+
+class _StaticEncoder:
+    """SentenceTransformer-style `encode` over a model2vec StaticModel (token-embedding lookup + mean, no transformer)."""
+
+    def __init__(self, model):
+        self._model = model
+
+    def encode(self, texts, batch_size: int = 1024, show_progress_bar: bool = False, normalize_embeddings: bool = False):
+        vectors = np.asarray(self._model.encode(texts, batch_size=batch_size, show_progress_bar=show_progress_bar), dtype=np.float32)
+        if normalize_embeddings:
+            lens = np.linalg.norm(vectors, axis=1, keepdims=True)
+            lens[lens == 0] = 1.0
+            vectors = vectors / lens
+        return vectors
+
 @lru_cache(maxsize=1)
 def get_model():
     model_name = os.getenv("NLP_MODEL_NAME", "paraphrase-multilingual-MiniLM-L12-v2")
-    logging.info(f"Loading NLP: {model_name}")
-    return SentenceTransformer(f"./models/{model_name}")
+    # "torch" (default), "onnx", or "model2vec" for a static model distilled with model2vec.distill.
+    # Stored embeddings come from the configured model: re-seed after switching.
+    backend = os.getenv("NLP_BACKEND", "torch").lower()
+    if backend == "model2vec":
+        from model2vec import StaticModel
+
+        logging.info(f"Loading NLP: {model_name} (model2vec)")
+        return _StaticEncoder(StaticModel.from_pretrained(f"./models/{model_name}"))
+
+    # imported on first use so importing db/match doesn't pull in torch
+    from sentence_transformers import SentenceTransformer
 
-model = get_model()
+    # onnx needs `optimum[onnxruntime]` and exports the model on first load
+    kwargs = {}
+    if backend != "torch":
+        kwargs["backend"] = backend
+        # e.g. onnx/model_O3.onnx or onnx/model_qint8_avx512.onnx for an optimized/quantized export
+        onnx_file = os.getenv("NLP_ONNX_FILE")
+        if onnx_file:
+            kwargs["model_kwargs"] = {"file_name": onnx_file}
+    logging.info(f"Loading NLP: {model_name} ({backend})")
+    return SentenceTransformer(f"./models/{model_name}", **kwargs)
+
+# distinct texts whose encodings are kept; repeated user questions skip the model
+ENCODE_CACHE_SIZE = 4096
+
+# optional persistent store behind the in-process cache, with get(text) and put(text, bytes)
+_encode_store: Any = None
+
+def set_encode_store(store: Any) -> None:
+    """Install a persistent encoding store (see db.EmbeddingCache); None disables it."""
+    global _encode_store
+    _encode_store = store
+
+@lru_cache(maxsize=ENCODE_CACHE_SIZE)
+def _encode_cached(text: str) -> bytes:
+    store = _encode_store
+    if store is not None:
+        try:
+            blob = store.get(text)
+        except Exception:
+            logger.exception("Embedding store lookup failed; encoding instead.")
+            blob = None
+        if blob is not None:
+            return blob
+
+    # bytes, so no caller can mutate a cached vector
+    blob = get_model().encode([text], normalize_embeddings=True)[0].astype(np.float32, copy=False).tobytes()
+    if store is not None:
+        try:
+            store.put(text, blob)
+        except Exception:
+            logger.exception("Embedding store write failed.")
+    return blob
 
 def embed_vector(text: str) -> np.ndarray:
-    return model.encode([text])[0]
+    """Encode `text` as a read-only float32 vector, memoized by text."""
+    return np.frombuffer(_encode_cached(text), dtype=np.float32)
 
-def embed_text(text: str) -> List[bytes]:
+def embed_text(text: str) -> bytes:
     """
     Convert text to embedding using SentenceTransformer.
-    Returns a list of bytes representing the embedding.
+    Returns the embedding as raw float32 bytes, the format of the `embedding` BLOB columns.
+    Stored vectors are L2-normalized, so cosine against them is a plain dot product.
     """
     if not text:
         return []
     
-    embedding =  embed_vector(text)
-    return pickle.dumps(embedding)
+    return unit_vector(embed_vector(text)).tobytes()
+
+# texts per forward pass when embedding many rows at once
+ENCODE_BATCH_SIZE = 64
+
+def embed_vectors(texts: Sequence[str]) -> np.ndarray:
+    """(N, D) unit-length float32 encodings of `texts` from one batched model call."""
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    vectors = get_model().encode(list(texts), batch_size=ENCODE_BATCH_SIZE, show_progress_bar=False, normalize_embeddings=True)
+    return np.asarray(vectors, dtype=np.float32)
+
+def embed_texts(texts: Sequence[str]) -> List[bytes]:
+    """Batched `embed_text`: one model call for all `texts`, same unit-length float32 bytes per text."""
+    return [unit_vector(v).tobytes() for v in embed_vectors(texts)]
+
+def unit_vector(vec: np.ndarray) -> np.ndarray:
+    """`vec` as float32 scaled to length 1 (zero vectors are returned unchanged)."""
+    vec = np.asarray(vec, dtype=np.float32)
+    length = np.linalg.norm(vec)
+    return vec / length if length > 0 else vec
 
 def load_embedding(blob: Any) -> np.ndarray:
+    """Read-only float32 view over an `embedding` BLOB (no copy)."""
     if blob is None:
         return np.array([])
 
-    if isinstance(blob, memoryview) or isinstance(blob, bytearray):
-        blob = bytes(blob)
-    
     if isinstance(blob, str):
         raise ValueError("Expected bytes, got str")
 
-    return pickle.loads(blob)
+    return np.frombuffer(blob, dtype=np.float32)
 
-def find_best_embedding_match(user_question: str, embedding: List[Any]) -> Optional[Dict[str, Any]]:
+def load_pickled_embedding(blob: Any) -> np.ndarray:
+    """Decode an embedding written by older versions (a pickled ndarray); used only by the DB migration."""
+    return np.asarray(pickle.loads(bytes(blob)), dtype=np.float32)
+
+def stack_embeddings(blobs: Iterable[Any], count: Optional[int] = None) -> np.ndarray:
     """
-    Find the best matching answer for a user question from the provided embeddings.
-    embedding {'id': int, 'embedding': 'loaded_embedding'}
+    Decode embedding blobs into one contiguous (N, D) float32 matrix.
+    Rows are L2-normalized so cosine similarity becomes `matrix @ query`.
+    Missing embeddings, and any whose dimension differs from the first one, become zero rows
+    to keep the matrix aligned with its source (see `embedded_rows`).
+    Blobs are decoded straight into a preallocated matrix, so no per-row list of vectors is
+    built; `count` sizes it when `blobs` is a generator (otherwise it grows by doubling).
     """
-    if not embedding or not user_question:
-        return None
-    
-    user_norm = normalize_ar(user_question)
-    user_embedding = model.encode([user_norm])[0]
-    
-    scores = calculate_scores(user_embedding, embedding)
-    if scores is None or len(scores) == 0:
-        return None
+    capacity = count if count is not None else len(blobs) if hasattr(blobs, "__len__") else 256
+    mat: Optional[np.ndarray] = None
+    n = 0
+    for b in blobs:
+        v = load_embedding(b)
+        if mat is None:
+            if len(v) == 0:
+                n += 1
+                continue
+            mat = np.zeros((max(capacity, n + 1), len(v)), dtype=np.float32)
+        elif n == len(mat):
+            mat = np.concatenate([mat, np.zeros_like(mat)])
+        if len(v) == mat.shape[1]:
+            mat[n] = v
+        elif len(v) > 0:
+            logger.warning("Skipping embedding row %d: dimension %d, expected %d.", n, len(v), mat.shape[1])
+        n += 1
+    if mat is None:
+        return np.zeros((n, 0), dtype=np.float32)
+    # drop unused capacity rather than keep it alive behind a view
+    mat = mat if n == len(mat) else mat[:n].copy()
 
-    best_idx = np.argmax(scores[:, 1])
-    best_score = scores[best_idx, :]
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    mat /= norms
+    return mat
 
-    best_match = {
-        "qa_id": int(best_score[0]),
-        "score": float(best_score[1]),
-    }
-    
-    return best_match
+def embedded_rows(mat: np.ndarray) -> np.ndarray:
+    """Boolean mask of rows that hold an embedding; the zero rows `stack_embeddings` pads with are False."""
+    return mat.any(axis=1)
+
+def quantize_matrix(mat: np.ndarray, dtype: str = "float32") -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Convert a normalized float32 matrix to its in-memory storage dtype.
+    Returns `(matrix, scales)`; `scales` is a per-row float32 factor for int8, else None.
+    """
+    if dtype == "float16":
+        return mat.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(mat).max(axis=1, keepdims=True) / 127.0 if mat.size else np.ones((len(mat), 1), dtype=np.float32)
+        scales[scales == 0] = 1.0
+        q = np.round(mat / scales).astype(np.int8)
+        return q, scales.ravel().astype(np.float32)
+    if dtype != "float32":
+        logger.warning("Unknown embedding dtype %r, falling back to float32.", dtype)
+    return mat, None
+
+# rows fetched from the ANN index before exact rescoring
+ANN_CANDIDATES = 10
 
-def find_best_match(user_question: str, qas: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+def find_best_match(user_question: str, qas: List[Dict[str, Any]], emb_matrix: Optional[np.ndarray] = None, emb_scales: Optional[np.ndarray] = None, is_normalized: bool = False, index: Any = None) -> Optional[Dict[str, Any]]:
     """
     Find the best matching answer for a user question from the provided Q&A pairs.
     qas [{'id': int, 'question': str, 'question_norm': str, 'embedding': bytes, 'answer': str, 'category': str}]
+    emb_matrix: optional pre-stacked matrix (see `stack_embeddings`) aligned row-for-row with `qas`.
+    emb_scales: per-row scales when `emb_matrix` is int8 (see `quantize_matrix`).
+    is_normalized: set when `user_question` already went through `normalize_ar`.
+    index: optional ANN index over `emb_matrix`; only its top candidates are rescored.
     """
     if not qas or not user_question:
         return None
-    
-    user_norm = normalize_ar(user_question)
-    user_embedding = model.encode([user_norm])[0]
-    
-    best_score = -1.0
-    best_qa_id = None
-
-    for qa in qas:
-        emb = load_embedding(qa.get("embedding"))
-        if emb is not None and len(emb) > 0:
-            score = calculate_score(user_embedding, emb, user_norm, qa.get("question_norm", qa.get("question")), exact=True, prefix=True)
-            if score > best_score:
-                best_score = score
-                best_qa_id = qa.get("id")
-    
-    if best_qa_id is not None:
-        return {
-            "qa_id": int(best_qa_id),
-            "score": best_score,
-        }
-    return None
\ No newline at end of file
+
+    if emb_matrix is None or emb_matrix.shape[0] != len(qas):
+        emb_matrix, emb_scales, index = stack_embeddings(qa.get("embedding") for qa in qas), None, None
+
+    ids = np.fromiter((qa["id"] for qa in qas), dtype=np.int64, count=len(qas))
+    norms = [qa.get("question_norm", qa.get("question")) for qa in qas]
+    user_norm = user_question if is_normalized else normalize_ar(user_question)
+    return find_best_match_columns(user_norm, ids, norms, emb_matrix, emb_scales, index)
+
+def find_best_match_batch(user_questions: Sequence[str], qas: List[Dict[str, Any]], emb_matrix: Optional[np.ndarray] = None, emb_scales: Optional[np.ndarray] = None, index: Any = None, valid: Optional[np.ndarray] = None) -> List[Optional[Dict[str, Any]]]:
+    """
+    `find_best_match` for many questions at once: all of them are encoded in one batched
+    model call, then each is scored against the corpus. Returns one result (or None) per question.
+    valid: `embedded_rows(emb_matrix)` when already known.
+    """
+    if not qas or not user_questions:
+        return [None] * len(user_questions)
+
+    if emb_matrix is None or emb_matrix.shape[0] != len(qas):
+        emb_matrix, emb_scales, index, valid = stack_embeddings(qa.get("embedding") for qa in qas), None, None, None
+    if valid is None:
+        valid = embedded_rows(emb_matrix)
+
+    ids = np.fromiter((qa["id"] for qa in qas), dtype=np.int64, count=len(qas))
+    norms = [qa.get("question_norm", qa.get("question")) for qa in qas]
+    user_norms = [normalize_ar(q) for q in user_questions]
+    asked = [i for i, n in enumerate(user_norms) if n]
+    results: List[Optional[Dict[str, Any]]] = [None] * len(user_questions)
+    if not asked or emb_matrix.shape[1] == 0 or not valid.any():
+        return results
+    user_embeddings = embed_vectors([user_norms[i] for i in asked])
+
+    if index is not None:
+        # each query rescoring its own ANN candidates
+        for row, i in enumerate(asked):
+            results[i] = find_best_match_columns(user_norms[i], ids, norms, emb_matrix, emb_scales, index, user_embeddings[row], valid=valid)
+        return results
+
+    scores = calculate_multi_scores(user_embeddings, emb_matrix, [user_norms[i] for i in asked], norms, exact=True, prefix=True, qa_scales=emb_scales)
+    # rows without an embedding never win, whatever their exact/prefix floor
+    scores[:, ~valid] = -1.0
+    best = scores.argmax(axis=1)
+    for row, i in enumerate(asked):
+        results[i] = {"qa_id": int(ids[best[row]]), "score": float(scores[row, best[row]])}
+    return results
+
+def find_best_match_columns(user_norm: str, ids: np.ndarray, norms: Sequence[str], emb_matrix: np.ndarray, emb_scales: Optional[np.ndarray] = None, index: Any = None, user_embedding: Optional[np.ndarray] = None, exact_ids: Optional[Mapping[str, int]] = None, valid: Optional[np.ndarray] = None) -> Optional[Dict[str, Any]]:
+    """
+    Column-wise form of `find_best_match`: rows are given as parallel `ids`, `norms`
+    (normalized questions) and `emb_matrix`, so answers/categories are never touched while scoring.
+    `user_norm` must already be normalized. `user_embedding` skips encoding when already known.
+    `exact_ids` maps normalized question/variant text to its Q&A id; a hit returns a full
+    score without encoding or scoring anything.
+    `valid` is `embedded_rows(emb_matrix)` when already known; rows without an embedding are never returned.
+    """
+    if not user_norm or len(ids) == 0 or emb_matrix is None or emb_matrix.shape[1] == 0:
+        return None
+
+    if exact_ids:
+        hit = exact_ids.get(user_norm)
+        if hit is not None:
+            return {"qa_id": int(hit), "score": 100.0}
+
+    if valid is None:
+        valid = embedded_rows(emb_matrix)
+    if not valid.any():
+        return None
+
+    if user_embedding is None:
+        user_embedding = embed_vector(user_norm)
+
+    if index is not None:
+        user_len = np.linalg.norm(user_embedding)
+        rows = ann_index.search(index, user_embedding / user_len, ANN_CANDIDATES) if user_len > 0 else None
+        if rows is not None and len(rows) > 0:
+            ids = ids[rows]
+            norms = [norms[i] for i in rows]
+            emb_matrix = emb_matrix[rows]
+            emb_scales = emb_scales[rows] if emb_scales is not None else None
+            valid = valid[rows]
+            if not valid.any():
+                return None
+
+    scores = calculate_batch_scores(user_embedding, emb_matrix, user_norm, norms, exact=True, prefix=True, qa_scales=emb_scales)
+    # rows without an embedding never win, whatever their exact/prefix floor
+    scores[~valid] = -1.0
+
+    best = int(scores.argmax())
+    return {
+        "qa_id": int(ids[best]),
+        "score": float(scores[best]),
+    }
@@ -3,12 +3,23 @@
 Telegram FAQ Bot — Arabic Text Normalization
 """
 import re
+from functools import lru_cache
 
-# Precompiled regex patterns for performance
-_DIACRITICS = re.compile(r"[\u0617-\u061A\u064B-\u0652\u0657-\u065F\u0670\u06D6-\u06ED]")
-_TATWEEL = re.compile(r"\u0640")  # ـ
-_PUNCT = re.compile(r"[\u060C\u061B\u061F\u066A-\u066D\u06D4\u06F4\u06F5\u06F6\u06F7\u06F8\u06F9!\"#$%&'()*+,\-./:;<=>?@\[\\\]^_`{|}~]")
-_MULTI_SPACE = re.compile(r"\s{2,}")
+def _code_range(first: int, last: int) -> range:
+    return range(first, last + 1)
+
+# Diacritics & tatweel (ـ) → removed
+_REMOVE = [
+    *_code_range(0x0617, 0x061A), *_code_range(0x064B, 0x0652), *_code_range(0x0657, 0x065F),
+    0x0670, *_code_range(0x06D6, 0x06ED),
+    0x0640,
+]
+
+# Punctuation (Arabic & Latin) → space, to keep word separation
+_PUNCT_CHARS = (
+    "\u060C\u061B\u061F" + "".join(map(chr, _code_range(0x066A, 0x066D))) + "\u06D4"
+    + "\u06F4\u06F5\u06F6\u06F7\u06F8\u06F9" + "!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~"
+)
 
 # Arabic to Western digits mapping
 _AR_DIGITS = {ord(a): ord(w) for a, w in zip("٠١٢٣٤٥٦٧٨٩", "0123456789")}
@@ -24,6 +35,16 @@ _CHAR_MAP = {
     ord("ة"): ord("ه"),
 }
 
+# every per-character rule above in one table, applied in a single str.translate pass
+_TRANS = {
+    **dict.fromkeys(_REMOVE),
+    **dict.fromkeys(map(ord, _PUNCT_CHARS), ord(" ")),
+    **_CHAR_MAP,
+    **_AR_DIGITS,
+}
+
+_MULTI_SPACE = re.compile(r"\s{2,}")
+
 
 def normalize_ar(text: str) -> str:
     """Normalize Arabic text for robust matching.
@@ -41,19 +62,18 @@ def normalize_ar(text: str) -> str:
     """
     if not isinstance(text, str):
         return ""
+    return _normalize(text)
 
-    s = text.strip()
 
-    # Remove diacritics & tatweel & punctuation
-    s = _DIACRITICS.sub("", s)
-    s = _TATWEEL.sub("", s)
-    s = _PUNCT.sub(" ", s)
+# user messages and seed questions repeat, so recent results are memoized
+NORMALIZE_CACHE_SIZE = 8192
 
-    # Character normalizations (Alef, Yeh)
-    s = s.translate(_CHAR_MAP)
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize(text: str) -> str:
+    s = text.strip()
 
-    # Convert Arabic digits → Western
-    s = s.translate(_AR_DIGITS)
+    # Diacritics, tatweel, punctuation, Alef/Yeh/Waw/Teh Marbuta and digits in one pass
+    s = s.translate(_TRANS)
 
     # Collapse extra spaces
     s = _MULTI_SPACE.sub(" ", s)
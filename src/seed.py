@@ -3,13 +3,17 @@
 Telegram FAQ Bot — One-shot migration from a JSON seed file into SQLite.
 """
 
+import logging
 import sqlite3
 import json
 from datetime import datetime
 from typing import Dict, Any
 
 from normalize import normalize_ar
-from db import add_qna, get_qna_by_question, add_variant
+from db import add_qna_many, get_qna_by_question, add_variants_many, list_variant_keys
+
+# per-row progress is DEBUG (cheap when disabled); only rows that need attention are WARNING
+logger = logging.getLogger(__name__)
 
 def _validate_qa(i: int, item: Dict[str, Any]) -> None:
     if not isinstance(item, dict):
@@ -49,12 +53,13 @@ def migrate_qa(conn: sqlite3.Connection, json_path: str) -> int:
             raise ValueError("Seed JSON must be a list of objects.")
 
     inserted = 0
+    items = []
 
     for i, item in enumerate(data, start=1):
         try:
             _validate_qa(i, item)
         except ValueError as e:
-            print(f"Skipping item #{i} due to validation error: {e}")
+            logger.warning("Skipping item #%d due to validation error: %s", i, e)
             continue
 
         q = item["question"].strip()
@@ -64,19 +69,18 @@ def migrate_qa(conn: sqlite3.Connection, json_path: str) -> int:
         qn = normalize_ar(q)
         if not qn:
             raise ValueError(f"Item #{i} has an empty normalized question.")
-        
-        try:
-            re = add_qna(conn, q, qn, a, c)
-        except sqlite3.IntegrityError:
-            re = None
+        items.append((i, (q, qn, a, c)))
 
+    # one batched encode and one transaction for the whole file
+    ids = add_qna_many(conn, [row for _, row in items])
+
+    for (i, (q, _, a, c)), re in zip(items, ids):
         if re:
             inserted += 1
-            print(f"Inserted/updated item #{i}: {q} -> {a} (category: {c})")
+            logger.debug("Inserted/updated item #%d: %s -> %s (category: %s)", i, q, a, c)
         else:
-            print(f"Skipped duplicate item #{i}: {q}")
+            logger.debug("Skipped duplicate item #%d: %s", i, q)
 
-    conn.commit()
     return inserted
 
 def migrate_variants(conn: sqlite3.Connection, json_path: str) -> int:
@@ -97,13 +101,14 @@ def migrate_variants(conn: sqlite3.Connection, json_path: str) -> int:
         if not isinstance(data, list):
             raise ValueError("Seed JSON must be a list of objects.")
 
-    inserted = 0
+    seen = list_variant_keys(conn)
+    rows = []
 
     for i, item in enumerate(data, start=1):
         try:
             _validate_paraphrase(i, item)
         except ValueError as e:
-            print(f"Skipping item #{i} due to validation error: {e}")
+            logger.warning("Skipping item #%d due to validation error: %s", i, e)
             continue
         
         q = item["question"].strip()
@@ -111,21 +116,25 @@ def migrate_variants(conn: sqlite3.Connection, json_path: str) -> int:
         
         qna = get_qna_by_question(conn, q)
         if not qna:
-            print(f"Skipping item #{i} because question '{q}' not found in Q&A.")
+            logger.warning("Skipping item #%d because question '%s' not found in Q&A.", i, q)
             continue
         
         for variant in variants:
             normalized_variant = normalize_ar(variant)
             if not normalized_variant:
-                print(f"Skipping empty variant in item #{i}.")
+                logger.warning("Skipping empty variant in item #%d.", i)
                 continue
 
-            re = add_variant(conn, qna["id"], variant, normalized_variant)
-            if re:
-                inserted += 1
-                print(f"Inserted variant for item #{i}: {variant} (normalized: {normalized_variant})")
-            else:
-                print(f"Skipped duplicate variant for item #{i}: {variant} (normalized: {normalized_variant})")
-            
-    conn.commit()
+            key = (qna["id"], normalized_variant)
+            if key in seen:
+                logger.debug("Skipped duplicate variant for item #%d: %s (normalized: %s)", i, variant, normalized_variant)
+                continue
+            seen.add(key)
+            rows.append((qna["id"], variant, normalized_variant))
+            logger.debug("Queued variant for item #%d: %s (normalized: %s)", i, variant, normalized_variant)
+
+    # one batched encode and one executemany/commit for the whole file
+    inserted = add_variants_many(conn, rows)
+    if inserted < len(rows):
+        logger.debug("Skipped %d queued variant(s) already present in the database.", len(rows) - inserted)
     return inserted
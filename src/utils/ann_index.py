@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Telegram FAQ Bot — Optional Approximate Nearest-Neighbour Index (FAISS)
+"""
+
+import logging
+from typing import Any, Optional
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # optional dependency
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+HNSW_M = 32
+# FAISS defaults (40 / 16) trade recall for speed; at FAQ scale the wider beam is still sub-millisecond
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 50
+
+
+def build_index(matrix: Optional[np.ndarray], kind: str = "none", scales: Optional[np.ndarray] = None) -> Optional[Any]:
+    """
+    Build an inner-product index over the L2-normalized embedding `matrix`.
+    kind: "none" (exact scan), "flat" (IndexFlatIP) or "hnsw" (IndexHNSWFlat).
+    Quantized matrices are expanded back to float32 using `scales`.
+    Returns None when disabled, empty, or FAISS is not installed.
+    """
+    if kind in ("", "none") or matrix is None or matrix.size == 0:
+        return None
+    if faiss is None:
+        logger.warning("QA_INDEX_TYPE=%s but faiss is not installed; using exact search.", kind)
+        return None
+
+    dim = matrix.shape[1]
+    if kind == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        logger.warning("Unknown QA_INDEX_TYPE %r; using exact search.", kind)
+        return None
+
+    vectors = matrix.astype(np.float32)
+    if scales is not None:
+        vectors *= scales[:, None]
+    index.add(np.ascontiguousarray(vectors))
+    return index
+
+
+def search(index: Any, query: np.ndarray, k: int) -> np.ndarray:
+    """Return row indices of the `k` rows closest to the unit-length `query`."""
+    _, idx = index.search(np.ascontiguousarray(query, dtype=np.float32)[None, :], k)
+    return idx[0][idx[0] >= 0]
@@ -3,60 +3,120 @@
 Telegram FAQ Bot — Score Calculation Utilities
 """
 
-from typing import Dict, Any, List
+import math
+import os
+from typing import List, Optional
 import numpy as np
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
 
-def _cos(a, b):
-    denom = np.linalg.norm(a) * np.linalg.norm(b)
-    if denom == 0:
-        return 0.0
-    return float(np.dot(a, b) / denom) 
+try:
+    import numba
+except ImportError:  # optional accelerator
+    numba = None
 
-def calculate_score(user_embedding: np.ndarray, qa_embedding: np.ndarray, user_normalize: str, qa_normalize: str, exact: bool=False, prefix: bool=False) -> float:
+try:
+    import simsimd
+except ImportError:  # optional accelerator
+    simsimd = None
+
+# similarity kernel: "numpy" (BLAS), "numba" or "simsimd"
+SIM_BACKEND = os.getenv("QA_SIM_BACKEND", "numpy").lower()
+# below this many rows the JIT kernel's thread fan-out isn't worth it
+NUMBA_MIN_ROWS = 64
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _dot_rows_numba(mat, vec):
+        out = np.empty(mat.shape[0], dtype=np.float32)
+        for i in numba.prange(mat.shape[0]):
+            s = 0.0
+            for j in range(mat.shape[1]):
+                s += mat[i, j] * vec[j]
+            out[i] = s
+        return out
+
+def dot_rows(mat: np.ndarray, vec: np.ndarray) -> np.ndarray:
     """
-    Calculate the similarity score between user query embedding and Q&A embedding.
-    Returns a score between 0 and 100.
+    Return `mat @ vec` using the configured backend.
+    The numba and SimSIMD kernels are meant for hosts where NumPy has no optimized BLAS.
     """
-    if user_embedding is None or qa_embedding is None:
-        return 0.0
-    
-    c = _cos(user_embedding, qa_embedding)
-    c01 = (c + 1.0) / 2.0 # Scale cosine from [-1,1] to [0,1]
+    if SIM_BACKEND == "numba" and numba is not None and mat.dtype != np.float16 and mat.shape[0] > NUMBA_MIN_ROWS:
+        return _dot_rows_numba(mat, vec)
+    # SimSIMD kernels need both operands in the same dtype (float32 or float16)
+    if SIM_BACKEND == "simsimd" and simsimd is not None and mat.dtype == vec.dtype and mat.dtype != np.int8:
+        return np.asarray(simsimd.cdist(mat, vec[None, :], metric="dot"), dtype=np.float32).ravel()
+    return mat @ vec
+
+def int8_cosines(mat: np.ndarray, unit: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """
+    Cosine of the unit-length float32 `unit` against every row of an int8 matrix with per-row `scales`.
+    SimSIMD compares int8 against int8 directly; cosine ignores per-vector scale, so the
+    query only needs quantizing the same symmetric way and `scales` drop out.
+    """
+    if SIM_BACKEND == "simsimd" and simsimd is not None:
+        peak = np.abs(unit).max()
+        q = np.round(unit * (127.0 / peak)).astype(np.int8) if peak > 0 else np.zeros(len(unit), dtype=np.int8)
+        return 1.0 - np.asarray(simsimd.cdist(mat, q[None, :], metric="cosine"), dtype=np.float32).ravel()
+    return dot_rows(mat, unit) * scales
+
+def calculate_batch_scores(user_embedding: np.ndarray, qa_matrix: np.ndarray, user_normalize: str, qa_normalizes: List[str], exact: bool=False, prefix: bool=False, qa_scales: Optional[np.ndarray]=None) -> np.ndarray:
+    """
+    Score the user query against every row of an L2-normalized (N, D) matrix:
+    0.65 * rescaled cosine + 0.35 * token_set_ratio, with the exact/prefix floors.
+    Cosine similarity is a single matrix-vector product.
+    `qa_matrix` may be float32, float16, or int8 with per-row `qa_scales`.
+    Returns an array of N scores between 0 and 100.
+    """
+    n = len(qa_normalizes)
+    user_len = math.sqrt(float(np.vdot(user_embedding, user_embedding)))
+    if user_len == 0.0:
+        c = np.zeros(n, dtype=np.float32)
+    else:
+        user_unit = (user_embedding / user_len).astype(np.float32, copy=False)
+        if qa_matrix.dtype == np.int8:
+            c = int8_cosines(qa_matrix, user_unit, qa_scales)
+        else:
+            c = dot_rows(qa_matrix, user_unit.astype(qa_matrix.dtype, copy=False))
 
-    tf = fuzz.token_set_ratio(user_normalize, qa_normalize) / 100.0
+    # one C-level pass over all rows instead of a Python call per row
+    tf = process.cdist([user_normalize], qa_normalizes, scorer=fuzz.token_set_ratio, dtype=np.float32)[0] / 100.0
+
+    return _blend_scores(c, tf, user_normalize, qa_normalizes, exact, prefix)
+
+def calculate_multi_scores(user_embeddings: np.ndarray, qa_matrix: np.ndarray, user_normalizes: List[str], qa_normalizes: List[str], exact: bool=False, prefix: bool=False, qa_scales: Optional[np.ndarray]=None) -> np.ndarray:
+    """
+    `calculate_batch_scores` for Q queries at once: cosines come from one (Q, D) x (D, N)
+    matrix product and fuzz scores from one multi-threaded `cdist`.
+    Returns a (Q, N) array of scores between 0 and 100.
+    """
+    lens = np.linalg.norm(user_embeddings, axis=1, keepdims=True)
+    lens[lens == 0] = 1.0
+    units = (user_embeddings / lens).astype(np.float32, copy=False)
+    if qa_matrix.dtype == np.int8:
+        c = (units @ qa_matrix.T.astype(np.float32)) * qa_scales[None, :]
+    else:
+        c = units.astype(qa_matrix.dtype, copy=False) @ qa_matrix.T
+
+    tf = process.cdist(user_normalizes, qa_normalizes, scorer=fuzz.token_set_ratio, dtype=np.float32, workers=-1) / 100.0
+
+    return np.vstack([
+        _blend_scores(c[i], tf[i], u, qa_normalizes, exact, prefix) for i, u in enumerate(user_normalizes)
+    ])
+
+def _blend_scores(c: np.ndarray, tf: np.ndarray, user_normalize: str, qa_normalizes: List[str], exact: bool, prefix: bool) -> np.ndarray:
+    """Combine cosine `c` and fuzz `tf` (0..1) rows into 0..100 scores, applying the exact/prefix floors."""
+    n = len(qa_normalizes)
+    c01 = (c + 1.0) / 2.0 # Scale cosine from [-1,1] to [0,1]
 
     score = 0.65 * c01 + 0.35 * tf
 
-    if exact and user_normalize == qa_normalize:
-        score = max(score, 0.99)
-    elif prefix and qa_normalize.startswith(user_normalize):
-        score = max(score, 0.90)
-
-    # Scale to percentage
-    return max(0.0, min(100.0, score * 100))
-
-def calculate_scores(user_embedding: np.ndarray, embeddings: List[Dict[str, Any]]) -> np.ndarray:
-    """
-    Calculate scores for a list of embeddings against the user query embedding.
-    Returns a list of scores.
-    """
-    if user_embedding is None or embeddings is None or len(embeddings) == 0:
-        return []
-    
-    # Calculate cosine similarity for all embeddings
-    embedding_values = np.stack([item.get("embedding") for item in embeddings], axis=0)
-    scores = np.dot(embedding_values, user_embedding) / (
-        np.linalg.norm(embedding_values, axis=1) * np.linalg.norm(user_embedding)
-    )
-    
-    # Scale to percentage
-    scores = np.clip(scores * 100, 0.0, 100.0).tolist()
-
-    # add id to scores
-    ids = np.array([item.get("id") for item in embeddings])
-    scores = np.stack((ids, scores), axis=1)
-    return scores
-
-# best_idx = np.argmax(scores)
-# best_score = scores[best_idx]
\ No newline at end of file
+    if prefix:
+        is_prefix = np.fromiter((q.startswith(user_normalize) for q in qa_normalizes), dtype=bool, count=n)
+        np.maximum(score, 0.90, out=score, where=is_prefix)
+    if exact:
+        is_exact = np.fromiter((q == user_normalize for q in qa_normalizes), dtype=bool, count=n)
+        np.maximum(score, 0.99, out=score, where=is_exact)
+
+    # Scale to percentage (in place; `score` is a fresh array here)
+    np.multiply(score, 100.0, out=score)
+    return np.clip(score, 0.0, 100.0, out=score)
@@ -1,4 +1,5 @@
 from enum import Enum
+from functools import lru_cache
 
 class Category(Enum):
     REGISTRATION = "التسجيل"
@@ -9,17 +10,23 @@ class Category(Enum):
     GENERAL = "عام"
 
     @classmethod
+    @lru_cache(maxsize=None)
     def get_all_arabic(cls):
-        return [category.value for category in cls]
+        return tuple(category.value for category in cls)
 
     @classmethod
     def get_arabic(cls, category: str) -> str:
         """Return the Arabic name for a given category."""
-        for cat in cls:
-            if cat.name.lower() == category.lower():
-                return cat.value
-        return None
+        return _ARABIC_BY_NAME.get(category.lower())
     
+    @classmethod
+    def parse(cls, name: str) -> "Category | None":
+        """Return the member named `name` (case-insensitive), or None."""
+        return _BY_NAME.get(name.strip().lower()) if name else None
+
     @classmethod
     def predict_category(q: str):
-        pass
\ No newline at end of file
+        pass
+
+_BY_NAME = {c.name.lower(): c for c in Category}
+_ARABIC_BY_NAME = {name: c.value for name, c in _BY_NAME.items()}
@@ -1,15 +1,15 @@
 import os
-from typing import List
+from functools import lru_cache
+from typing import Optional, Tuple
 
-def load_admin_ids() -> List[int]:
-    s = os.getenv("ADMIN_IDS", "")
-    ids = []
-    for part in (s.split(",") if s else []):
-        part = part.strip()
-        if not part:
-            continue
-        try:
-            ids.append(int(part))
-        except ValueError:
-            continue
-    return ids
\ No newline at end of file
+def _parse_id(part: str) -> Optional[int]:
+    try:
+        return int(part)
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=1)
+def load_admin_ids() -> Tuple[int, ...]:
+    """Admin user ids from the comma-separated ADMIN_IDS env var; blank or malformed entries are skipped."""
+    ids = (_parse_id(p) for p in os.getenv("ADMIN_IDS", "").split(",") if p.strip())
+    return tuple(i for i in ids if i is not None)